@@ -0,0 +1,82 @@
+from __future__ import print_function
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector
+from main.inference import load_image
+import argparse
+import time
+
+
+def same_results(result, other_result):
+    """
+    Compares two results of classify_img / classify_images with return_scores set.
+    """
+    boxes, scores = result
+    other_boxes, other_scores = other_result
+    return np.array_equal(boxes, other_boxes) and np.allclose(scores, other_scores)
+
+
+def main(parsed):
+    """
+    Times DWSDetector.classify_img on every image against DWSDetector.classify_images on all of them. With --check
+    the results of classify_images are compared to the ones of classify_img, they have to be identical.
+    """
+    parsed = parsed[0]
+    imdb = get_imdb(parsed.test_set)
+    net = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                      frozen_graph=parsed.frozen_graph, is_training=parsed.is_training == "True",
+                      uint8_input=parsed.uint8_input == "True")
+    imgs = [load_image(imdb, i, parsed.model_path, parsed.scaling)
+            for i in range(min(parsed.nr_images, len(imdb.image_index)))]
+    print("{} images, batch norms use {} statistics, {}".format(
+        len(imgs), "batch" if net.batch_statistics else "moving",
+        "images are run one by one" if net.batch_statistics else "images are batched"))
+
+    # warm up
+    net.classify_img(imgs[0], parsed.cutoff, parsed.min_size, return_scores=True)
+
+    start_time = time.time()
+    single = [net.classify_img(img, parsed.cutoff, parsed.min_size, return_scores=True) for img in imgs]
+    single_time = time.time() - start_time
+    start_time = time.time()
+    batched = net.classify_images(imgs, parsed.cutoff, parsed.min_size, max_batch_size=parsed.max_batch_size,
+                                  return_scores=True)
+    batched_time = time.time() - start_time
+    print("classify_img    {:8.3f} s / image".format(single_time / len(imgs)))
+    print("classify_images {:8.3f} s / image, speedup {:.2f}x".format(batched_time / len(imgs),
+                                                                     single_time / batched_time))
+
+    if parsed.check == "True":
+        differing = [i for i, (result, other_result) in enumerate(zip(single, batched))
+                     if not same_results(result, other_result)]
+        if differing:
+            print("images {}: classify_images differs from classify_img".format(differing))
+            sys.exit(1)
+        print("classify_images matches classify_img")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset the images are taken from")
+    parser.add_argument("--model_path", type=str, default="experiments/music/pretrain_lvl_semseg/RefineNet-Res101/run_0", help="directory of the checkpoint, relative to the root directory")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res101", help="type of resnet used (RefineNet-Res152/101/50)")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--frozen_graph", type=str, default=None, help="if set, the net is loaded from this frozen GraphDef instead of the checkpoint")
+    parser.add_argument("--is_training", type=str, default="True", help="batch norm mode of the checkpoint net, images are only batched if set to False")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, images are fed as uint8 and cast and padded in the graph")
+    parser.add_argument("--nr_images", type=int, default=8, help="number of test set images")
+    parser.add_argument("--max_batch_size", type=int, default=4, help="maximum number of images per session run of classify_images")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to images after loading")
+    parser.add_argument("--cutoff", type=int, default=1, help="energy cutoff")
+    parser.add_argument("--min_size", type=int, default=4, help="minimum connected component size")
+    parser.add_argument("--check", type=str, default="True", help="if set to True, the results of classify_images have to match the ones of classify_img")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
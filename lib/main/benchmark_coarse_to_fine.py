@@ -0,0 +1,105 @@
+from __future__ import print_function
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector
+from main.quantize_net import evaluate
+from main.inference import load_image, predict_maps, dws_maps
+from main.export_graph import mismatch_fraction
+import argparse
+
+
+def compare_maps(net, imdb, parsed):
+    """
+    Runs the first compare_images pages with the mode set in parsed and in a single pass.
+    returns:
+        fraction of the map pixels that differ, number of pages whose boxes differ
+    """
+    mode = parsed.coarse_to_fine, parsed.skip_blank
+    differences, differing_pages = [], 0
+    for i in range(min(parsed.compare_images, len(imdb.image_index))):
+        im = load_image(imdb, i, parsed.model_path, parsed.scaling)
+        maps = predict_maps(net, im, parsed)
+        parsed.coarse_to_fine, parsed.skip_blank = "False", "False"
+        single_maps = predict_maps(net, im, parsed)
+        parsed.coarse_to_fine, parsed.skip_blank = mode
+        differences.append(mismatch_fraction(single_maps, maps, rtol=0, atol=0))
+        differing_pages += not np.array_equal(dws_maps(single_maps)[0], dws_maps(maps)[0])
+    return np.mean(differences), differing_pages
+
+
+def main(parsed):
+    """
+    Evaluates one net with the single pass prediction, with coarse-to-fine prediction at each of --coarse_scales and
+    with blank cell skipping, reports the mAP, the time per page (net and post-processing), the fraction of the
+    page run at full resolution and, on the first --compare_images pages, the fraction of the map pixels that differ
+    from the single pass and the number of pages whose boxes differ. Fails if blank cell skipping with
+    --blank_tolerance 0 and --blank_max_ink 0 changes the maps or boxes of the single pass.
+    """
+    parsed = parsed[0]
+    imdb = get_imdb(parsed.test_set)
+    net = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                      frozen_graph=parsed.frozen_graph, uint8_input=parsed.uint8_input == "True")
+
+    results = []
+    parsed.coarse_to_fine, parsed.skip_blank = "False", "False"
+    mean_ap, seconds = evaluate(net, imdb, "single_pass", parsed)
+    results.append(("single pass", mean_ap, seconds, 1., 0., 0))
+    parsed.coarse_to_fine = "True"
+    for coarse_scale in [float(scale) for scale in parsed.coarse_scales.split(",")]:
+        parsed.coarse_scale = coarse_scale
+        net.cells_seen, net.cells_run = 0, 0
+        mean_ap, seconds = evaluate(net, imdb, "coarse_to_fine_{}".format(coarse_scale), parsed)
+        fraction = net.cells_run / float(max(net.cells_seen, 1))
+        results.append(("coarse {}".format(coarse_scale), mean_ap, seconds, fraction) +
+                       compare_maps(net, imdb, parsed))
+    parsed.coarse_to_fine, parsed.skip_blank = "False", "True"
+    net.cells_seen, net.cells_run = 0, 0
+    mean_ap, seconds = evaluate(net, imdb, "skip_blank", parsed)
+    fraction = net.cells_run / float(max(net.cells_seen, 1))
+    results.append(("skip blank", mean_ap, seconds, fraction) + compare_maps(net, imdb, parsed))
+
+    print("{:<14s} {:>8s} {:>9s} {:>10s} {:>9s} {:>8s} {:>9s} {:>12s} {:>12s}".format(
+        "mode", "mAP@0.5", "mAP diff", "s / page", "pages/s", "speedup", "page run", "maps differ", "pages differ"))
+    for name, mean_ap, seconds, fraction, difference, differing_pages in results:
+        print("{:<14s} {:8.4f} {:+9.4f} {:10.3f} {:9.2f} {:7.2f}x {:9.2f} {:12.5f} {:12d}".format(
+            name, mean_ap, mean_ap - results[0][1], seconds, 1 / seconds, results[0][2] / seconds, fraction,
+            difference, differing_pages))
+
+    # only entirely white cells are skipped, this must not change the output of the single pass
+    if parsed.blank_tolerance == 0 and parsed.blank_max_ink == 0 and (results[-1][4] > 0 or results[-1][5] > 0):
+        print("skip blank with --blank_tolerance 0 --blank_max_ink 0 changes the maps or boxes of the single pass")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset to evaluate on")
+    parser.add_argument("--model_path", type=str, default="experiments/music/pretrain_lvl_semseg/RefineNet-Res101/run_0", help="directory of the checkpoint, relative to the root directory")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res101", help="type of resnet used (RefineNet-Res152/101/50)")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--frozen_graph", type=str, default=None, help="if set, the net is loaded from this frozen GraphDef instead of the checkpoint")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, images are fed as uint8 and cast and padded in the graph")
+    parser.add_argument("--max_images", type=int, default=1000000, help="number of images detected for the evaluation, images without detections count as misses")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to images after loading")
+    parser.add_argument("--max_detections", type=int, default=800, help="maximum number of detections kept per image")
+    parser.add_argument("--max_untiled_pixels", type=int, default=3837*2713, help="images with more pixels (after scaling) are run through the net in tiles, tiled outputs differ from whole page ones, see benchmark_tiling.py")
+    parser.add_argument("--tile_size", type=int, default=1280, help="side length of the tiles used for oversized images, multiple of 160")
+    parser.add_argument("--tile_overlap", type=int, default=320, help="overlap of neighbouring tiles, multiple of 160")
+    parser.add_argument("--coarse_scales", type=str, default="0.25,0.5", help="comma separated scales of the low resolution pass that are benchmarked")
+    parser.add_argument("--coarse_cutoff", type=int, default=0, help="energy cutoff of the low resolution pass")
+    parser.add_argument("--coarse_context", type=int, default=160, help="context in pixels run around the regions found, rounded up to multiples of 160")
+    parser.add_argument("--coarse_max_fraction", type=float, default=.6, help="if the regions found (by coarse_to_fine or skip_blank) cover more of the page, the whole page is run")
+    parser.add_argument("--blank_tolerance", type=int, default=0, help="pixels that differ by at most this from white count as blank, values above 0 trade accuracy (faint strokes are skipped) for speed")
+    parser.add_argument("--blank_max_ink", type=int, default=0, help="cells with at most this many non blank pixels are skipped, values above 0 trade accuracy for speed")
+    parser.add_argument("--blank_context", type=int, default=160, help="context in pixels run around the cells with ink, rounded up to multiples of 160")
+    parser.add_argument("--compare_images", type=int, default=10, help="number of pages whose maps and boxes are compared to the single pass")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
@@ -0,0 +1,231 @@
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+from main.dws_transform import find_connected_comp, label_components, label_components_strips, \
+    component_statistics, assemble_boxes, perform_dws_array, perform_dws_batch, ComponentTree
+import argparse
+import time
+import tracemalloc
+
+# number of softmax levels used for the energy, equals cfg.TRAIN.MAX_ENERGY
+MAX_ENERGY = 20
+
+
+def synthesize_maps(height, width, nr_objects, object_size, overlap=0.0, nr_classes=124, class_noise=0.1, seed=0):
+    """
+    Builds energy, class and bounding box maps that look like the (argmaxed) output of the net. Every object is an
+    oval energy marker whose energy decreases linearly from MAX_ENERGY-1 at the center to 0 at the border, the class
+    and bbox maps hold the class and size of the object on its marker.
+    inputs:
+        height, width - page size in pixels
+        nr_objects - number of objects placed on the page
+        object_size - mean object diameter in pixels
+        overlap - fraction of objects that are placed overlapping the previous object
+        nr_classes - number of classes, class 0 is background
+        class_noise - fraction of marker pixels that get a random class
+        seed - seed of the random generator
+    returns:
+        energy - int32 ndarray of shape [height, width]
+        class_map - int32 ndarray of shape [height, width]
+        bbox_map - float32 ndarray of shape [height, width, 2], (height, width) of the object
+    """
+    rng = np.random.RandomState(seed)
+    energy = np.zeros((height, width), dtype=np.int32)
+    class_map = np.zeros((height, width), dtype=np.int32)
+    bbox_map = np.zeros((height, width, 2), dtype=np.float32)
+    top, left = 0, 0
+    for nr in range(nr_objects):
+        size_y, size_x = np.maximum(rng.normal(object_size, object_size * 0.3, 2), 2).astype(int)
+        if nr > 0 and rng.uniform() < overlap:
+            # shift the previous position by less than an object size
+            top = int(np.clip(top + rng.randint(-size_y // 2, size_y // 2 + 1), 0, max(height - size_y, 0)))
+            left = int(np.clip(left + rng.randint(-size_x // 2, size_x // 2 + 1), 0, max(width - size_x, 0)))
+        else:
+            top = rng.randint(0, max(height - size_y, 1))
+            left = rng.randint(0, max(width - size_x, 1))
+        y_coords = (np.arange(size_y) + 0.5 - size_y * 0.5) / (size_y * 0.5)
+        x_coords = (np.arange(size_x) + 0.5 - size_x * 0.5) / (size_x * 0.5)
+        marker = 1 - np.sqrt(np.square(y_coords[:, None]) + np.square(x_coords[None, :]))
+        marker = np.round(np.clip(marker, 0, 1) * (MAX_ENERGY - 1)).astype(np.int32)
+
+        window = (slice(top, top + size_y), slice(left, left + size_x))
+        marker = marker[:energy[window].shape[0], :energy[window].shape[1]]
+        on_marker = marker > energy[window]
+        energy[window][on_marker] = marker[on_marker]
+        class_map[window][on_marker] = rng.randint(1, nr_classes)
+        bbox_map[window][on_marker] = (size_y, size_x)
+
+    noisy = (rng.uniform(size=class_map.shape) < class_noise) & (energy > 0)
+    class_map[noisy] = rng.randint(1, nr_classes, size=int(np.count_nonzero(noisy)))
+    return energy, class_map, bbox_map
+
+
+def synthesize_energy(height, width, nr_objects, object_size, seed=0):
+    """
+    Energy map only version of synthesize_maps.
+    """
+    return synthesize_maps(height, width, nr_objects, object_size, seed=seed)[0]
+
+
+def legacy_label_image(binar_energy):
+    """
+    Runs the dict based find_connected_comp on a binarized energy map (255 background, 0 foreground)
+    and converts its output into a label image.
+    """
+    labels = find_connected_comp(np.transpose(binar_energy))
+    label_img = np.zeros(binar_energy.shape, dtype=np.int64)
+    for (x, y), component in labels.items():
+        label_img[y, x] = component + 1
+    return label_img
+
+
+def reference_dws(dws_energy, class_map, bbox_map, cutoff=0, min_ccoponent_size=0):
+    """
+    Reference implementation of perform_dws: dict based labeling and one pass over every component.
+    """
+    binar_energy = (dws_energy <= cutoff) * 255
+    labels = find_connected_comp(np.transpose(binar_energy))
+    labels_inv = {}
+    for k, v in labels.items():
+        labels_inv[v] = labels_inv.get(v, [])
+        labels_inv[v].append(k)
+
+    bbox_list = []
+    for key in labels_inv.keys():
+        if len(labels_inv[key]) < min_ccoponent_size:
+            continue
+        pixel_coords = np.asanyarray(labels_inv[key])
+        center = np.average(pixel_coords, 0).astype(int)
+        comp_class = np.bincount(class_map[pixel_coords[:, 1], pixel_coords[:, 0]]).argmax()
+        bbox_size = np.amax(bbox_map[pixel_coords[:, 1], pixel_coords[:, 0]], 0).astype(int)
+        bbox_list.append([int(np.round(center[0] - (bbox_size[1] / 2.0), 0)),
+                          int(np.round(center[1] - (bbox_size[0] / 2.0), 0)),
+                          int(np.round(center[0] + (bbox_size[1] / 2.0), 0)),
+                          int(np.round(center[1] + (bbox_size[0] / 2.0), 0)),
+                          int(comp_class)])
+    return bbox_list
+
+
+def same_partition(labels_a, labels_b):
+    """
+    Checks whether two label images describe the same components, independent of the label numbering.
+    """
+    if not np.array_equal(labels_a == 0, labels_b == 0):
+        return False
+    fg = labels_a != 0
+    pairs = np.unique(np.stack([labels_a[fg], labels_b[fg]], 1), axis=0)
+    return len(pairs) == len(np.unique(labels_a[fg])) == len(np.unique(labels_b[fg]))
+
+
+def time_function(fp, repeats, *args):
+    """
+    Runs fp repeats times, returns its result, the median run time and the peak memory allocated by one run.
+    """
+    timings = []
+    for _ in range(repeats):
+        start_time = time.time()
+        result = fp(*args)
+        timings.append(time.time() - start_time)
+
+    tracemalloc.start()
+    fp(*args)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, np.median(timings), peak_memory
+
+
+def benchmark_page(energy, class_map, bbox_map, parsed):
+    """
+    Times the stages of the DWS post-processing on one page.
+    returns:
+        dict mapping stage name to seconds (and stage name + "_mem" to peak bytes), the labels and the boxes
+    """
+    stats = dict()
+    labels, stats["labeling"], stats["labeling_mem"] = time_function(label_components, parsed.repeats,
+                                                                      energy > parsed.cutoff)
+    statistics, stats["statistics"], stats["statistics_mem"] = time_function(
+        component_statistics, parsed.repeats, labels, class_map, bbox_map, parsed.min_size)
+    _, stats["assembly"], stats["assembly_mem"] = time_function(assemble_boxes, parsed.repeats, *statistics[:5])
+    boxes, stats["perform_dws"], stats["perform_dws_mem"] = time_function(
+        perform_dws_array, parsed.repeats, energy, class_map, bbox_map, parsed.cutoff, parsed.min_size)
+    if parsed.strips > 1:
+        strip_labels, stats["strips"], stats["strips_mem"] = time_function(
+            label_components_strips, parsed.repeats, energy > parsed.cutoff, parsed.strips)
+        if not np.array_equal(strip_labels, labels):
+            print("strip labels differ from whole image labels")
+            sys.exit(1)
+    return stats, labels, boxes
+
+
+def main(parsed):
+    parsed = parsed[0]
+    print("{} pages {}x{}, {} objects of size {}, overlap {}".format(parsed.pages, parsed.width, parsed.height,
+                                                                    parsed.objects, parsed.object_size,
+                                                                    parsed.overlap))
+    page_stats = []
+    # maps and reference boxes of all pages, for the check of perform_dws_batch
+    pages, references = [], []
+    for page in range(parsed.pages):
+        energy, class_map, bbox_map = synthesize_maps(parsed.height, parsed.width, parsed.objects, parsed.object_size,
+                                                      parsed.overlap, seed=parsed.seed + page)
+        stats, labels, boxes = benchmark_page(energy, class_map, bbox_map, parsed)
+        page_stats.append(stats)
+
+        if parsed.check == "True":
+            start_time = time.time()
+            reference = reference_dws(energy, class_map, bbox_map, parsed.cutoff, parsed.min_size)
+            stats["reference"] = time.time() - start_time
+            if boxes.tolist() != reference:
+                print("page {}: boxes differ from the reference implementation".format(page))
+                sys.exit(1)
+            tree = ComponentTree(energy, class_map, bbox_map)
+            if tree.get_boxes(parsed.cutoff, parsed.min_size).tolist() != reference:
+                print("page {}: ComponentTree boxes differ from the reference implementation".format(page))
+                sys.exit(1)
+            pages.append((energy, class_map, bbox_map))
+            references.append(reference)
+            if not same_partition(labels, legacy_label_image((energy <= parsed.cutoff) * 255)):
+                print("page {}: label images differ from find_connected_comp".format(page))
+                sys.exit(1)
+        print("page {}: {} components, {} boxes".format(page, labels.max(), len(boxes)))
+
+    if parsed.check == "True":
+        energy, class_map, bbox_map = [np.stack(maps) for maps in zip(*pages)]
+        batch_boxes = perform_dws_batch(energy, class_map, bbox_map, parsed.cutoff, parsed.min_size, parsed.strips)
+        for page, (boxes, reference) in enumerate(zip(batch_boxes, references)):
+            if boxes.tolist() != reference:
+                print("page {}: perform_dws_batch boxes differ from the reference implementation".format(page))
+                sys.exit(1)
+
+    print("{:<14s} {:>12s} {:>12s}".format("stage", "s / page", "peak MB"))
+    for stage in ["labeling", "statistics", "assembly", "perform_dws", "strips", "reference"]:
+        if stage not in page_stats[0]:
+            continue
+        seconds = np.mean([stats[stage] for stats in page_stats])
+        if stage + "_mem" in page_stats[0]:
+            peak_memory = np.max([stats[stage + "_mem"] for stats in page_stats]) / 1e6
+            print("{:<14s} {:12.4f} {:12.1f}".format(stage, seconds, peak_memory))
+        else:
+            print("{:<14s} {:12.4f} {:>12s}".format(stage, seconds, "-"))
+    if parsed.check == "True":
+        print("outputs match the reference implementation")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=3, help="number of synthetic pages")
+    parser.add_argument("--height", type=int, default=1500, help="page height in pixels")
+    parser.add_argument("--width", type=int, default=2000, help="page width in pixels")
+    parser.add_argument("--objects", type=int, default=1000, help="number of synthetic objects per page")
+    parser.add_argument("--object_size", type=int, default=12, help="mean object diameter in pixels")
+    parser.add_argument("--overlap", type=float, default=0.2, help="fraction of objects overlapping their predecessor")
+    parser.add_argument("--cutoff", type=int, default=1, help="energy cutoff used for binarization")
+    parser.add_argument("--min_size", type=int, default=4, help="minimum connected component size")
+    parser.add_argument("--repeats", type=int, default=5, help="number of timed runs, the median is reported")
+    parser.add_argument("--strips", type=int, default=4, help="number of strips for the parallel labeling, 1 disables it")
+    parser.add_argument("--seed", type=int, default=314, help="seed for the synthetic maps")
+    parser.add_argument("--check", type=str, default="True", help="if set to True, compare against the dict based reference implementation")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
@@ -0,0 +1,113 @@
+from __future__ import print_function
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+import tensorflow as tf
+from models.dwd_net import build_dwd_net
+from models.graph_transforms import optimize_graph_def
+import argparse
+import time
+
+# outputs of the benchmarked graph, the raw (not argmaxed) head outputs
+OUTPUT_NAMES = ["energy", "class", "bbox"]
+
+
+def build_frozen_net(backbone, parsed):
+    """
+    Builds the inference net of one backbone with random weights and random batch norm statistics (so that the
+    folding is actually exercised) and freezes it.
+    returns:
+        frozen GraphDef with the input "input" and the outputs "energy", "class" and "bbox"
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.set_random_seed(parsed.seed)
+        input = tf.placeholder(tf.float32, shape=[None, None, None, 1], name="input")
+        used_losses = {"stamp_energy": parsed.energy_loss, "stamp_class": parsed.class_loss,
+                       "stamp_bbox": parsed.bbox_loss}
+        network_heads, _ = build_dwd_net(input, model=backbone, num_classes=parsed.num_classes, pretrained_dir="",
+                                         used_heads=list(used_losses.keys()), is_training=False,
+                                         used_losses=used_losses)
+        for head, name in [("stamp_energy", "energy"), ("stamp_class", "class"), ("stamp_bbox", "bbox")]:
+            tf.identity(network_heads[0][head][used_losses[head]][-1], name=name)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            rng = np.random.RandomState(parsed.seed)
+            for var in tf.global_variables():
+                shape = var.get_shape().as_list()
+                if "moving_variance" in var.name or "gamma" in var.name:
+                    var.load(rng.uniform(0.5, 1.5, shape).astype(np.float32), sess)
+                elif "moving_mean" in var.name or "beta" in var.name:
+                    var.load(rng.normal(0, 0.1, shape).astype(np.float32), sess)
+            return tf.graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), OUTPUT_NAMES)
+
+
+def run_graph(graph_def, canv, repeats):
+    """
+    Runs a GraphDef repeats times on canv, returns the outputs and the median run time.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name="")
+        with tf.Session() as sess:
+            fetches = [name + ":0" for name in OUTPUT_NAMES]
+            outputs = sess.run(fetches, feed_dict={"input:0": canv})
+            timings = []
+            for _ in range(repeats):
+                start_time = time.time()
+                sess.run(fetches, feed_dict={"input:0": canv})
+                timings.append(time.time() - start_time)
+    return outputs, np.median(timings)
+
+
+def op_count(graph_def):
+    return len(graph_def.node)
+
+
+def main(parsed):
+    parsed = parsed[0]
+    rng = np.random.RandomState(parsed.seed)
+    canv = rng.randint(0, 256, size=(1, parsed.height, parsed.width, 1)).astype(np.float32)
+
+    print("{:<18s} {:>9s} {:>9s} {:>10s} {:>10s} {:>8s} {:>10s} {:>8s}".format(
+        "backbone", "ops", "ops opt", "ms", "ms opt", "speedup", "max diff", "argmax"))
+    failed = False
+    for backbone in parsed.backbones.split(","):
+        frozen = build_frozen_net(backbone, parsed)
+        optimized = optimize_graph_def(frozen, ["input"] + OUTPUT_NAMES)
+
+        outputs, seconds = run_graph(frozen, canv, parsed.repeats)
+        outputs_opt, seconds_opt = run_graph(optimized, canv, parsed.repeats)
+
+        # difference relative to the magnitude of the outputs, and agreement of the argmaxed maps
+        max_diff = max(np.max(np.abs(a - b)) / max(np.max(np.abs(a)), 1e-6) for a, b in zip(outputs, outputs_opt))
+        argmax_agreement = min(np.mean(np.argmax(a, -1) == np.argmax(b, -1))
+                               for a, b in zip(outputs, outputs_opt) if a.shape[-1] > 1)
+        failed = failed or max_diff > parsed.tolerance
+        print("{:<18s} {:9d} {:9d} {:10.1f} {:10.1f} {:8.2f} {:10.2e} {:8.4f}".format(
+            backbone, op_count(frozen), op_count(optimized), seconds * 1000, seconds_opt * 1000, seconds / seconds_opt,
+            max_diff, argmax_agreement))
+
+    if failed:
+        print("optimized graph differs by more than {}".format(parsed.tolerance))
+        sys.exit(1)
+    print("optimized graphs are numerically equivalent")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backbones", type=str, default="RefineNet-Res50,RefineNet-Res101,RefineNet-Res152", help="comma separated list of backbones")
+    parser.add_argument("--height", type=int, default=640, help="input height, multiple of 160")
+    parser.add_argument("--width", type=int, default=480, help="input width, multiple of 160")
+    parser.add_argument("--num_classes", type=int, default=124, help="number of classes of the class head")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--repeats", type=int, default=5, help="number of timed runs, the median is reported")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="maximum relative difference of the outputs")
+    parser.add_argument("--seed", type=int, default=314, help="seed for the weights and the input")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
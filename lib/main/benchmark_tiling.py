@@ -0,0 +1,66 @@
+from __future__ import print_function
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector, _tile_ranges
+from main.inference import load_image, dws_maps
+from main.export_graph import mismatch_fraction
+import argparse
+import time
+
+
+def main(parsed):
+    """
+    Runs pages of the test set whole and in tiles (DWSDetector.predict_maps_tiled) and reports the fraction of the map
+    pixels and of the boxes that differ, and the time of the tiled run. Pages have to be small enough to be run whole.
+    """
+    parsed = parsed[0]
+    imdb = get_imdb(parsed.test_set)
+    net = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                      frozen_graph=parsed.frozen_graph, uint8_input=parsed.uint8_input == "True")
+    print("batch norms use {} statistics".format("batch" if net.batch_statistics else "moving"))
+
+    print("{:<6s} {:>12s} {:>8s} {:>8s} {:>12s} {:>10s} {:>10s}".format(
+        "page", "size", "tiles", "boxes", "maps differ", "boxes kept", "s tiled"))
+    differences, kept_fractions = [], []
+    for i in range(min(parsed.max_images, len(imdb.image_index))):
+        im = load_image(imdb, i, parsed.model_path, parsed.scaling)
+        maps = net.predict_maps(im)
+        start_time = time.time()
+        tiled_maps = net.predict_maps_tiled(im, parsed.tile_size, parsed.tile_overlap)
+        seconds = time.time() - start_time
+
+        boxes = set(map(tuple, dws_maps(maps)[0].tolist()))
+        tiled_boxes = set(map(tuple, dws_maps(tiled_maps)[0].tolist()))
+        differences.append(mismatch_fraction(maps, tiled_maps, rtol=0, atol=0))
+        kept_fractions.append(len(boxes & tiled_boxes) / float(max(len(boxes), 1)))
+        nr_tiles = len(_tile_ranges(maps[0].shape[1], parsed.tile_size, parsed.tile_overlap)) * \
+            len(_tile_ranges(maps[0].shape[2], parsed.tile_size, parsed.tile_overlap))
+        print("{:<6d} {:>12s} {:8d} {:8d} {:12.5f} {:10.4f} {:10.3f}".format(
+            i, "{}x{}".format(im.shape[1], im.shape[0]), nr_tiles, len(boxes), differences[-1], kept_fractions[-1],
+            seconds))
+    print("mean: {:.5f} of the map pixels differ, {:.4f} of the boxes are found unchanged".format(
+        np.mean(differences), np.mean(kept_fractions)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset the pages are taken from")
+    parser.add_argument("--model_path", type=str, default="experiments/music/pretrain_lvl_semseg/RefineNet-Res101/run_0", help="directory of the checkpoint, relative to the root directory")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res101", help="type of resnet used (RefineNet-Res152/101/50)")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--frozen_graph", type=str, default=None, help="if set, the net is loaded from this frozen GraphDef instead of the checkpoint")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, images are fed as uint8 and cast and padded in the graph")
+    parser.add_argument("--max_images", type=int, default=10, help="number of test set pages compared")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to images after loading")
+    parser.add_argument("--tile_size", type=int, default=640, help="side length of the tiles, multiple of 160, smaller than the pages so that they are tiled")
+    parser.add_argument("--tile_overlap", type=int, default=320, help="overlap of neighbouring tiles, multiple of 160")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
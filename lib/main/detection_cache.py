@@ -0,0 +1,138 @@
+import numpy as np
+import os
+import glob
+import hashlib
+import threading
+
+
+class DetectionCache(object):
+    """
+    Content addressed on-disk cache of the DWS output of single pages. An entry is keyed by the hash of the image file,
+    the fingerprint of the net weights and every setting that changes the detections (scaling, cutoff,
+    min_component_size, tiling, ...), it holds the [N, 6] float32 array [x1, y1, x2, y2, class, score] in the coordinates of the
+    scaled image, before any top k selection. Entries are single .npy files, the least recently used ones are deleted
+    once the cache grows over max_bytes. Safe to use from several threads and processes, the size accounting and
+    eviction are per process.
+    """
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.sizes = dict()
+        for file_name in glob.glob(os.path.join(cache_dir, "*", "*.npy")):
+            try:
+                self.sizes[file_name] = os.path.getsize(file_name)
+            except OSError:
+                # evicted by another process
+                pass
+        self.bytes = sum(self.sizes.values())
+
+    def key(self, image_file, fingerprint, settings):
+        """
+        inputs:
+            settings - dict of the settings that change the detections, values are compared by their repr
+        """
+        with open(image_file, "rb") as f:
+            image_hash = hashlib.sha1(f.read()).hexdigest()
+        settings = "|".join([image_hash, fingerprint] + ["{}={!r}".format(name, settings[name]) for name in sorted(settings)])
+        return hashlib.sha1(settings.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        returns:
+            (boxes, scores) as returned by perform_dws_array(..., return_scores=True), None if the key is not cached
+        """
+        file_name = self._file_name(key)
+        try:
+            detections = np.load(file_name)
+        except (IOError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            # mark as recently used
+            os.utime(file_name, None)
+        except OSError:
+            # evicted by another process in the meantime
+            pass
+        with self._lock:
+            self.hits += 1
+        return detections[:, :5].astype(np.int64), detections[:, 5].astype(np.float64)
+
+    def put(self, key, boxes, scores):
+        detections = np.concatenate([np.asarray(boxes, dtype=np.float32).reshape(-1, 5),
+                                     np.asarray(scores, dtype=np.float32).reshape(-1, 1)], 1)
+        file_name = self._file_name(key)
+        if not os.path.isdir(os.path.dirname(file_name)):
+            try:
+                os.makedirs(os.path.dirname(file_name))
+            except OSError:
+                # created by another thread
+                pass
+        # write to a temporary file first, so readers never see a partial entry, the cache may be shared by processes
+        tmp_name = file_name + ".{}.{}.tmp".format(os.getpid(), threading.current_thread().ident)
+        with open(tmp_name, "wb") as f:
+            np.save(f, detections)
+        # the size is taken before the rename, afterwards another process may already have evicted the entry
+        size = os.path.getsize(tmp_name)
+        os.rename(tmp_name, file_name)
+
+        with self._lock:
+            self.bytes += size - self.sizes.get(file_name, 0)
+            self.sizes[file_name] = size
+            if self.bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self):
+        return dict(cache_hits=self.hits, cache_misses=self.misses, cache_evictions=self.evictions,
+                    cache_entries=len(self.sizes), cache_bytes=self.bytes)
+
+    def _file_name(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npy")
+
+    def _evict(self):
+        # oldest modification time first, reads refresh it
+        by_age = sorted(self.sizes, key=_modification_time)
+        for file_name in by_age:
+            if self.bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(file_name)
+            except OSError:
+                # already evicted by another process
+                pass
+            self.bytes -= self.sizes.pop(file_name)
+            self.evictions += 1
+
+
+def _modification_time(file_name):
+    try:
+        return os.path.getmtime(file_name)
+    except OSError:
+        return 0
+
+
+def weights_fingerprint(weights_file):
+    """
+    Fingerprint of the weights the detector was loaded from: the hash of a frozen graph file, or for a checkpoint
+    prefix the hash of its .index file (which holds a checksum of every tensor) and the sizes of its data files.
+    """
+    sha = hashlib.sha1()
+    if os.path.isfile(weights_file):
+        with open(weights_file, "rb") as f:
+            sha.update(f.read())
+        return sha.hexdigest()
+
+    for file_name in sorted(glob.glob(weights_file + ".*")):
+        if file_name.endswith(".index"):
+            with open(file_name, "rb") as f:
+                sha.update(f.read())
+        else:
+            sha.update("{}:{}".format(os.path.basename(file_name), os.path.getsize(file_name)).encode("utf-8"))
+    return sha.hexdigest()
@@ -0,0 +1,161 @@
+import numpy as np
+import os
+import json
+
+# columns of a record row: x1, y1, x2, y2, class, score
+RECORD_COLUMNS = 6
+# entries of the progress index: page, offset of the record in the log (in rows), number of rows
+INDEX_COLUMNS = 3
+
+
+class DetectionLog(object):
+    """
+    Append-only on-disk log of the detections of test_net. Every page is one record of float32 rows
+    [x1, y1, x2, y2, class, score] in detections.bin, the progress index detections.idx holds (page, offset, rows) as
+    int64 and is only written once the record is on disk, so after a crash the log is cut back to the last indexed
+    record and the run resumes from there.
+    If a header (e.g. the weights fingerprint and the detection settings) is given, it is stored in header.json when
+    the log is created, and a log written with another header (or without one) is not resumed.
+    """
+    def __init__(self, log_dir, header=None):
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        self.log_file = os.path.join(log_dir, "detections.bin")
+        self.index_file = os.path.join(log_dir, "detections.idx")
+        self.header_file = os.path.join(log_dir, "header.json")
+
+        index = np.zeros((0, INDEX_COLUMNS), dtype=np.int64)
+        if os.path.exists(self.index_file):
+            index = np.fromfile(self.index_file, dtype=np.int64)
+            # drop a partially written index entry
+            index = index[:len(index) // INDEX_COLUMNS * INDEX_COLUMNS].reshape(-1, INDEX_COLUMNS)
+        log_rows = os.path.getsize(self.log_file) // (4 * RECORD_COLUMNS) if os.path.exists(self.log_file) else 0
+        index = index[index[:, 1] + index[:, 2] <= log_rows]
+        self.rows = int((index[:, 1] + index[:, 2]).max()) if len(index) else 0
+
+        # cut off records that are not in the index
+        with open(self.log_file, "ab") as f:
+            f.truncate(self.rows * 4 * RECORD_COLUMNS)
+        with open(self.index_file, "ab") as f:
+            f.truncate(index.nbytes)
+        self.index = dict((int(page), (int(offset), int(rows))) for page, offset, rows in index)
+        if header is not None:
+            self._check_header(header)
+
+        self._log = open(self.log_file, "ab")
+        self._index = open(self.index_file, "ab")
+
+    def _check_header(self, header):
+        # compared after a round trip, so that e.g. tuples equal the lists they are read back as
+        header = json.loads(json.dumps(header, sort_keys=True))
+        if os.path.exists(self.header_file):
+            with open(self.header_file) as f:
+                try:
+                    log_header = json.load(f)
+                except ValueError:
+                    log_header = None
+            if log_header != header:
+                raise ValueError("the detection log in {} was written with other weights or settings ({} instead of "
+                                 "{}), remove it or use another directory".format(os.path.dirname(self.log_file),
+                                                                                  log_header, header))
+        elif self.index:
+            raise ValueError("the detection log in {} has no header, the weights and settings it was written with "
+                             "are unknown, remove it or use another directory".format(os.path.dirname(self.log_file)))
+        else:
+            with open(self.header_file, "w") as f:
+                json.dump(header, f, sort_keys=True)
+
+    @property
+    def completed(self):
+        return set(self.index.keys())
+
+    def append(self, page, detections, sync=False):
+        """
+        Appends the [N, 6] detections of a page, a page that is logged again replaces its previous record.
+        """
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, RECORD_COLUMNS)
+        self._log.write(detections.tobytes())
+        self._log.flush()
+        if sync:
+            os.fsync(self._log.fileno())
+        entry = np.array([page, self.rows, len(detections)], dtype=np.int64)
+        self._index.write(entry.tobytes())
+        self._index.flush()
+        self.index[page] = (self.rows, len(detections))
+        self.rows += len(detections)
+
+    def read(self, page):
+        offset, rows = self.index[page]
+        return np.fromfile(self.log_file, dtype=np.float32, count=rows * RECORD_COLUMNS,
+                           offset=offset * 4 * RECORD_COLUMNS).reshape(rows, RECORD_COLUMNS)
+
+    def iter_pages(self, chunk_rows=1 << 20):
+        """
+        Yields (page, detections) in the order of the log, reading it sequentially in chunks.
+        """
+        records = sorted((offset, rows, page) for page, (offset, rows) in self.index.items())
+        with open(self.log_file, "rb") as f:
+            chunk_start, chunk = 0, np.zeros((0, RECORD_COLUMNS), dtype=np.float32)
+            for offset, rows, page in records:
+                if offset + rows > chunk_start + len(chunk):
+                    f.seek(offset * 4 * RECORD_COLUMNS)
+                    chunk_start = offset
+                    chunk = np.fromfile(f, dtype=np.float32, count=max(rows, chunk_rows) * RECORD_COLUMNS)
+                    chunk = chunk.reshape(-1, RECORD_COLUMNS)
+                yield page, chunk[offset - chunk_start:offset - chunk_start + rows]
+
+    def all_boxes(self, num_classes, num_images):
+        """
+        Streams the log into the all_boxes[class][image] layout of imdb.evaluate_detections, see merge_all_boxes.
+        """
+        return merge_all_boxes([self], num_classes, num_images)
+
+    def close(self):
+        self._log.close()
+        self._index.close()
+
+
+def merge_all_boxes(logs, num_classes, num_images):
+    """
+    Reads the logs (e.g. of the shards of one run) sequentially into the all_boxes[class][image] layout of
+    imdb.evaluate_detections. The detections of a class are held in one [M, 5] array [x1, y1, x2, y2, score] sorted by
+    image, images without detections of the class give []. The result does not depend on the order of the logs or of
+    the records within them, a page logged by several logs is taken from the last one.
+    """
+    pages, detections = [], []
+    seen = set()
+    for log in reversed(logs):
+        for page, page_detections in log.iter_pages():
+            if page in seen:
+                continue
+            pages.append(np.full(len(page_detections), page, dtype=np.int64))
+            detections.append(page_detections)
+        seen.update(log.completed)
+    pages = np.concatenate(pages) if pages else np.zeros(0, dtype=np.int64)
+    detections = np.concatenate(detections) if detections else np.zeros((0, RECORD_COLUMNS), dtype=np.float32)
+
+    # stable, so the detections of a page keep the order they were logged in
+    classes = detections[:, 4].astype(np.int64)
+    order = np.lexsort((pages, classes))
+    pages, classes, detections = pages[order], classes[order], detections[order][:, [0, 1, 2, 3, 5]]
+    class_starts = np.searchsorted(classes, np.arange(num_classes + 1))
+    return [ClassBoxes(detections[class_starts[c]:class_starts[c + 1]], pages[class_starts[c]:class_starts[c + 1]],
+                       num_images) for c in range(num_classes)]
+
+
+class ClassBoxes(object):
+    """
+    The list all_boxes[class] of one class, indexing by image returns a view of the detections of that image.
+    """
+    def __init__(self, detections, pages, num_images):
+        self.detections = detections
+        self.starts = np.searchsorted(pages, np.arange(num_images + 1))
+
+    def __len__(self):
+        return len(self.starts) - 1
+
+    def __getitem__(self, image):
+        start, end = self.starts[image], self.starts[image + 1]
+        if start == end:
+            return []
+        return self.detections[start:end]
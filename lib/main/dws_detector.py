@@ -1,19 +1,28 @@
 from __future__ import print_function
 import numpy as np
 import tensorflow as tf
-from models.dwd_net import build_dwd_net
-from main.dws_transform import perform_dws
+import cv2
+from scipy import ndimage
+from models.dwd_net import build_dwd_net, build_input
+from models.graph_transforms import optimize_graph_def
+from main.dws_transform import perform_dws, perform_dws_array, perform_dws_batch, ComponentTree
 from PIL import Image
 from main.config import cfg
 from datasets import fcn_groundtruth
+from utils.canvas_pool import CanvasPool
+from utils.timer import timed
 
 
 np.random.seed(314)
 tf.set_random_seed(314)
 
+# named tensors of the inference graph, energy_cutoff is a placeholder with default
+OUTPUT_NAMES = ["energy_map", "class_map", "bbox_map", "energy_cutoff", "energy_mask"]
+
 
 class DWSDetector:
-    def __init__(self, imdb, path, pa, individual_upsamp = False):
+    def __init__(self, imdb, path, pa, individual_upsamp = False, frozen_graph=None, is_training=True, uint8_input=False,
+                 max_canvases=4, intra_op_threads=0, inter_op_threads=0):
         self.model_path = path
         self.model_name = pa.net_type
         self.saved_net = pa.saved_net
@@ -21,28 +30,134 @@ class DWSDetector:
         self.energy_loss = pa.energy_loss
         self.class_loss = pa.class_loss
         self.bbox_loss = pa.bbox_loss
+        # feed uint8 images, the cast and the padding to a multiple of 160 happen in the graph
+        self.uint8_input = uint8_input
+        # reusable input canvases of predict_maps, keyed by padded shape, 0 disables the pool
+        self.canvas_pool = CanvasPool(max_canvases) if max_canvases > 0 else None
+        # optional TimingRegistry, predict_maps records its pad and session_run stages in it
+        self.timings = None
+        # cells of 160 x 160 pixels seen and run by predict_maps_coarse_to_fine and predict_maps_skip_blank
+        self.cells_seen = 0
+        self.cells_run = 0
+        # maps of a cell without objects, see background_maps
+        self.background = None
+        # True if the batch norms normalize with the statistics of the fed batch (is_training=True), the outputs of an
+        # image then depend on the other images of its batch and on the part of the page it is run on
+        self.batch_statistics = is_training
 
         self.tf_session = None
         self.root_dir = cfg.ROOT_DIR
-        self.sess = tf.Session()
-        print('Loading model')
+        # thread budget of the session, 0 lets tensorflow use all cores
+        self.config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                     inter_op_parallelism_threads=inter_op_threads)
+        self.config.gpu_options.allow_growth = True
+        self.sess = tf.Session(config=self.config)
+        self.tf_session = self.sess
 
-        if "realistic" in self.model_path:
-            self.input = tf.placeholder(tf.float32, shape=[None, None, None, 3])
+        # file (or checkpoint prefix) the weights are loaded from
+        self.weights_file = frozen_graph if frozen_graph is not None else \
+            self.root_dir + "/" + self.model_path + "/" + self.saved_net
+        if frozen_graph is not None:
+            print('Loading frozen graph')
+            self.load_frozen_graph(frozen_graph)
         else:
-            self.input = tf.placeholder(tf.float32, shape=[None, None, None, 1])
+            print('Loading model')
+            self.build_inference_net(imdb.num_classes, individual_upsamp, is_training)
 
-        self.network_heads, self.init_fn = build_dwd_net(self.input, model=self.model_name, num_classes=imdb.num_classes,
-                                               pretrained_dir="", substract_mean=False,  individual_upsamp = individual_upsamp)
+            self.saver = tf.train.Saver(max_to_keep=1000)
+            self.sess.run(tf.global_variables_initializer())
+            print("Loading weights")
+            self.saver.restore(self.sess, self.weights_file)
+        self.counter = 0
 
-        self.saver = tf.train.Saver(max_to_keep=1000)
-        self.sess.run(tf.global_variables_initializer())
-        print("Loading weights")
-        self.saver.restore(self.sess, self.root_dir + "/" + self.model_path + "/" + self.saved_net)
+    def build_inference_net(self, num_classes, individual_upsamp=False, is_training=True):
+        """
+        Builds the net with only the output layers of the heads and losses used for inference.
+        """
+        input_type = tf.uint8 if self.uint8_input else tf.float32
+        if "realistic" in self.model_path:
+            self.input = tf.placeholder(input_type, shape=[None, None, None, 3], name="input")
+        else:
+            self.input = tf.placeholder(input_type, shape=[None, None, None, 1], name="input")
+        net_input = build_input(self.input, pad_to=160) if self.uint8_input else self.input
+
+        used_losses = {"stamp_energy": self.energy_loss, "stamp_class": self.class_loss, "stamp_bbox": self.bbox_loss}
+        network_heads, self.init_fn = build_dwd_net(net_input, model=self.model_name, num_classes=num_classes,
+                                                    pretrained_dir="", substract_mean=False, individual_upsamp=individual_upsamp,
+                                                    used_heads=list(used_losses.keys()), is_training=is_training,
+                                                    used_losses=used_losses)
+        self.network_heads = network_heads[0]
+        self.build_output_maps()
+
+    def export_frozen_graph(self, file_name, optimize=False):
+        """
+        Folds the variables into constants and writes the graph, stripped down to the output maps, as a frozen GraphDef.
+        With optimize set, batch norms are folded into the convolutions, pass-through ops are removed and the 1x1 head
+        convolutions are merged (see models/graph_transforms.py), this needs a net built with is_training=False.
+        """
+        graph_def = tf.graph_util.convert_variables_to_constants(self.sess, self.sess.graph.as_graph_def(),
+                                                                 OUTPUT_NAMES)
+        if optimize:
+            graph_def = optimize_graph_def(graph_def, ["input"] + OUTPUT_NAMES)
+        with tf.gfile.GFile(file_name, "wb") as f:
+            f.write(graph_def.SerializeToString())
+        print("{} ops written to {}".format(len(graph_def.node), file_name))
+
+    def load_frozen_graph(self, file_name):
+        """
+        Imports a GraphDef written by export_frozen_graph, no variables have to be initialized or restored.
+        The graph gets its own session, so several frozen nets can be loaded in one process.
+        """
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(file_name, "rb") as f:
+            graph_def.ParseFromString(f.read())
+        graph = tf.Graph()
+        with graph.as_default():
+            self.input, self.energy_map, self.class_map, self.bbox_map, self.energy_cutoff, self.energy_mask = \
+                tf.import_graph_def(graph_def, name="", return_elements=[name + ":0" for name in ["input"] + OUTPUT_NAMES])
+        self.uint8_input = self.input.dtype == tf.uint8
+        self.batch_statistics = _uses_batch_statistics(graph_def)
+        self.sess.close()
+        self.sess = tf.Session(graph=graph, config=self.config)
         self.tf_session = self.sess
-        self.counter = 0
 
-    def classify_img(self, img, cutoff=0, min_ccoponent_size=0):
+    def build_output_maps(self):
+        """
+        Adds the inference outputs to the graph: softmax heads are argmaxed in the graph, the energy map as uint8
+        (cfg.TRAIN.MAX_ENERGY levels) and the class and bbox maps as int16, so that only small integer maps are fetched
+        from the session. Additionally builds a binarized energy mask (energy > self.energy_cutoff).
+        """
+        def argmax_head(logits, loss, dtype, name):
+            if loss == "softmax":
+                return tf.cast(tf.argmax(logits, axis=3), dtype, name=name)
+            return tf.identity(logits, name=name)
+
+        self.energy_map = argmax_head(self.network_heads["stamp_energy"][self.energy_loss][-1], self.energy_loss,
+                                      tf.uint8, "energy_map")
+        self.class_map = argmax_head(self.network_heads["stamp_class"][self.class_loss][-1], self.class_loss,
+                                     tf.int16, "class_map")
+        self.bbox_map = argmax_head(self.network_heads["stamp_bbox"][self.bbox_loss][-1], self.bbox_loss,
+                                    tf.int16, "bbox_map")
+
+        energy = self.energy_map if self.energy_loss == "softmax" else tf.squeeze(self.energy_map, -1)
+        self.energy_cutoff = tf.placeholder_with_default(tf.constant(0, dtype=energy.dtype), shape=[],
+                                                         name="energy_cutoff")
+        self.energy_mask = tf.greater(energy, self.energy_cutoff, name="energy_mask")
+
+    def stats(self):
+        """
+        Number of classified images and the allocation / reset cost and memory of the input canvases.
+        """
+        stats = dict(classified_images=self.counter)
+        if self.canvas_pool is not None:
+            stats.update(self.canvas_pool.stats())
+        if self.cells_seen > 0:
+            stats.update(cells_seen=self.cells_seen, cells_run=self.cells_run,
+                         fraction_run=self.cells_run / float(self.cells_seen))
+        return stats
+
+    def classify_img(self, img, cutoff=0, min_ccoponent_size=0, nr_strips=1, return_scores=False, tile_size=None,
+                     tile_overlap=320):
         """
         This function classifies an image based on the results of the net, has been tested with different values of cutoff and min_component_size and 
         we have observed that it is very robust to perturbations of those values.
@@ -50,9 +165,228 @@ class DWSDetector:
             img - the image, an ndarray
             cutoff - the cutoff we do for the enrgy
             min_component_size - the minimum size of the connected component
+            nr_strips - number of horizontal strips the energy map is labeled in parallel
+            return_scores - if set, an [N, 5] array of boxes and an [N] array of detection scores are returned instead
+            tile_size - if set, the net is run on overlapping tiles of this size, see predict_maps_tiled
+            tile_overlap - overlap of neighbouring tiles
         returns:
             dws_list - the list of bounding boxes the dwdnet infers
         """
+        if tile_size is None:
+            pred_energy, pred_class, pred_bbox = self.predict_maps(img)
+        else:
+            pred_energy, pred_class, pred_bbox = self.predict_maps_tiled(img, tile_size, tile_overlap)
+
+        if return_scores:
+            self.counter += 1
+            return perform_dws_array(pred_energy, pred_class, pred_bbox, cutoff, min_ccoponent_size, nr_strips,
+                                     return_scores=True)
+
+        dws_list = perform_dws(pred_energy, pred_class, pred_bbox, cutoff, min_ccoponent_size, nr_strips=nr_strips)
+        #save_images(canv, dws_list, True, False, self.counter)
+
+        self.counter += 1
+
+        return dws_list
+
+    def sweep_img(self, img, cutoffs, min_sizes):
+        """
+        Runs the net once and builds a component tree of the energy map, so that the detections for every combination
+        of cutoff and min_component_size can be read off without labeling again.
+        inputs:
+            img - the image, an ndarray
+            cutoffs - list of energy cutoffs, an entry can also be a sequence of per class cutoffs
+            min_sizes - list of minimum connected component sizes
+        returns:
+            dict mapping (cutoff, min_component_size) to an [N, 5] array of bounding boxes
+        """
+        tree = ComponentTree(*self.predict_maps(img))
+        self.counter += 1
+        return tree.sweep(cutoffs, min_sizes)
+
+    def classify_images(self, imgs, cutoff=0, min_ccoponent_size=0, max_batch_size=8, max_batch_pixels=None,
+                        return_scores=False):
+        """
+        Classifies a list of images. Images with the same padded shape are run through the net as one batch and
+        post-processed together with perform_dws_batch. Batching is only done for nets whose batch norms use the
+        moving statistics (is_training=False or a frozen graph exported that way), otherwise every image is run on
+        its own, so that the results are always the ones of classify_img.
+        inputs:
+            imgs - list of images, ndarrays
+            cutoff - the cutoff we do for the enrgy
+            min_component_size - the minimum size of the connected component
+            max_batch_size - maximum number of images per session run
+            max_batch_pixels - if set, caps the number of padded input pixels per session run, bounds the memory used
+                by the activations
+            return_scores - if set, every result is a tuple of an [N, 5] array of boxes and an [N] array of scores
+        returns:
+            list of results in the order of imgs, each one as returned by classify_img
+        """
+        canvases = [self.pad_image(img) for img in imgs]
+
+        # group by padded shape
+        groups = dict()
+        for nr, canv in enumerate(canvases):
+            groups.setdefault(canv.shape, []).append(nr)
+
+        results = [None] * len(imgs)
+        for shape, indices in groups.items():
+            # with batch statistics the outputs of an image depend on the other images of its batch
+            batch_size = max_batch_size if not self.batch_statistics else 1
+            if max_batch_pixels is not None:
+                batch_size = max(min(batch_size, max_batch_pixels // (shape[1] * shape[2])), 1)
+
+            for start in range(0, len(indices), batch_size):
+                batch = indices[start:start + batch_size]
+                pred_energy, pred_class, pred_bbox = self.run_net(np.concatenate([canvases[nr] for nr in batch]))
+                batch_results = perform_dws_batch(pred_energy, pred_class, pred_bbox, cutoff, min_ccoponent_size,
+                                                  return_scores=return_scores)
+                if return_scores:
+                    batch_results = list(zip(*batch_results))
+                else:
+                    batch_results = [boxes.tolist() for boxes in batch_results]
+                for nr, result in zip(batch, batch_results):
+                    results[nr] = result
+
+        self.counter += len(imgs)
+        return results
+
+    def predict_maps(self, img):
+        """
+        Pads the image, runs it through the net and returns the energy, class and bounding box maps (softmax outputs
+        are argmaxed).
+        """
+        return self.run_net(self.prepare_input(img))
+
+    def predict_maps_tiled(self, img, tile_size=1280, tile_overlap=320):
+        """
+        Like predict_maps, but the padded image is run through the net in overlapping tiles so that only the
+        activations of one tile are held at once. Every pixel of the stitched maps is taken from the tile in which it
+        lies furthest from the border, up to the middle of the overlap.
+        The stitched maps are not those of a whole page run: near the tile borders the receptive field is cut, and
+        with batch statistics (see self.batch_statistics) every tile is normalized with its own statistics, so they
+        differ everywhere. benchmark_tiling.py reports the difference on pages that can be run both ways.
+        inputs:
+            img - the image, an ndarray
+            tile_size - side length of the tiles, multiple of 160
+            tile_overlap - overlap of neighbouring tiles, multiple of 160 and smaller than tile_size
+        """
+        if tile_size % 160 != 0 or tile_overlap % 160 != 0 or tile_overlap >= tile_size:
+            raise ValueError("tile_size and tile_overlap must be multiples of 160 with tile_overlap < tile_size")
+
+        with timed(self.timings, "pad"):
+            canv = self.pad_image(img, self.canvas_pool)
+        maps = None
+        for y_0, y_1, core_y_0, core_y_1 in _tile_ranges(canv.shape[1], tile_size, tile_overlap):
+            for x_0, x_1, core_x_0, core_x_1 in _tile_ranges(canv.shape[2], tile_size, tile_overlap):
+                tile_maps = self.run_net(canv[:, y_0:y_1, x_0:x_1])
+                if maps is None:
+                    maps = [np.zeros(canv.shape[:3] + tile_map.shape[3:], dtype=tile_map.dtype)
+                            for tile_map in tile_maps]
+                for page_map, tile_map in zip(maps, tile_maps):
+                    page_map[:, core_y_0:core_y_1, core_x_0:core_x_1] = \
+                        tile_map[:, core_y_0 - y_0:core_y_1 - y_0, core_x_0 - x_0:core_x_1 - x_0]
+        return tuple(maps)
+
+    def predict_maps_coarse_to_fine(self, img, coarse_scale=0.25, cutoff=0, context=160, max_fraction=0.6):
+        """
+        Two pass prediction: only the energy head is run on a copy of the image downscaled by coarse_scale, the
+        160 x 160 cells of the padded canvas that contain energy > cutoff are then run at full resolution with
+        predict_cells. This is lossy: objects missed by the low resolution pass are not detected, and even the maps of
+        the cells that are run differ from predict_maps, see predict_cells.
+        returns:
+            the energy, class and bbox maps of the padded image, as predict_maps
+        """
+        with timed(self.timings, "coarse"):
+            small = cv2.resize(img, None, None, fx=coarse_scale, fy=coarse_scale, interpolation=cv2.INTER_AREA)
+            mask = self.predict_mask(small, cutoff)[0, :small.shape[0], :small.shape[1]]
+            cells = _coarse_cells(mask, img.shape[:2], coarse_scale)
+        with timed(self.timings, "pad"):
+            canv = self.pad_image(img, self.canvas_pool)
+        return self.predict_cells(canv, cells, context, max_fraction)
+
+    def predict_maps_skip_blank(self, img, tolerance=0, max_ink=0, context=160, max_fraction=0.6):
+        """
+        Runs only the 160 x 160 cells of the padded canvas with ink, a cell is blank if at most max_ink of its pixels
+        differ by more than tolerance from the white background, see predict_cells. With the defaults only cells that
+        are entirely white are skipped, larger values are lossy: faint or anti-aliased strokes are skipped as well.
+        Skipped cells get no energy, the cells that are run can still differ from predict_maps (see predict_cells),
+        benchmark_coarse_to_fine.py fails if the defaults change the maps or boxes of the single pass.
+        returns:
+            the energy, class and bbox maps of the padded image, as predict_maps
+        """
+        with timed(self.timings, "pad"):
+            canv = self.pad_image(img, self.canvas_pool)
+        with timed(self.timings, "blank_test"):
+            cells = _ink_cells(canv, tolerance, max_ink)
+        return self.predict_cells(canv, cells, context, max_fraction)
+
+    def predict_cells(self, canv, cells, context=160, max_fraction=0.6):
+        """
+        Runs the net on crops of the padded canvas around the groups of marked cells (a [H / 160, W / 160] bool array),
+        with context pixels (rounded up to cells) of context on every side. All other cells get the maps of a cell
+        without objects (background_maps). If the crops cover more than max_fraction of the canvas the whole canvas
+        is run.
+        The maps of the crops are not those of a whole canvas run: the receptive field is cut at the crop borders, and
+        with batch statistics (see self.batch_statistics) every crop is normalized with its own statistics.
+        returns:
+            the energy, class and bbox maps of canv
+        """
+        context_cells = int(np.ceil(context / 160.0))
+        crops = _cell_crops(cells, context_cells)
+        nr_cells = cells.size
+        crop_cells = sum((y_1 - y_0) * (x_1 - x_0) for (y_0, y_1, x_0, x_1), _ in crops) // 160 ** 2
+        self.cells_seen += nr_cells
+        if crop_cells > max_fraction * nr_cells:
+            self.cells_run += nr_cells
+            return self.run_net(canv)
+        self.cells_run += crop_cells
+
+        maps = [np.tile(cell_map, (1,) + cells.shape + (1,) * (cell_map.ndim - 3))
+                for cell_map in self.background_maps()]
+        for (y_0, y_1, x_0, x_1), (core_y_0, core_y_1, core_x_0, core_x_1) in crops:
+            crop_maps = self.run_net(canv[:, y_0:y_1, x_0:x_1])
+            for page_map, crop_map in zip(maps, crop_maps):
+                page_map[:, core_y_0:core_y_1, core_x_0:core_x_1] = \
+                    crop_map[:, core_y_0 - y_0:core_y_1 - y_0, core_x_0 - x_0:core_x_1 - x_0]
+        return tuple(maps)
+
+    def background_maps(self):
+        """
+        The maps of a cell without objects: zero energy, so that skipped cells never give detections. A net run on a
+        blank canvas is normalized with the statistics of that canvas and can show spurious energy, it is only run
+        once for the shapes and types of the maps.
+        returns:
+            the energy, class and bbox maps of a single [1, 160, 160] cell
+        """
+        if self.background is None:
+            canv = np.full([1, 160, 160, 3 if "realistic" in self.model_path else 1], 255, dtype=np.uint8)
+            self.background = [np.zeros_like(cell_map) for cell_map in self.run_net(canv)]
+        return self.background
+
+    def prepare_input(self, img):
+        """
+        Returns the [1, H, W, C] batch fed to the net for a single image: the padded canvas, or with uint8_input the
+        image itself, the graph casts and pads it.
+        """
+        with timed(self.timings, "pad"):
+            if not self.uint8_input:
+                return self.pad_image(img, self.canvas_pool)
+
+            img = np.asarray(img, dtype=np.uint8)
+            if img.shape[0] > 1:
+                img = np.expand_dims(img, 0)
+
+            if img.shape[-1] > 3:
+                img = np.expand_dims(img, -1)
+            return img
+
+    def pad_image(self, img, pool=None):
+        """
+        Copies the image into a white canvas whose sides are multiples of 160, returns a [1, H, W, C] batch.
+        If a CanvasPool is given the canvas is taken from it, it is then only valid until the pool hands out the next
+        canvas of that shape.
+        """
         if img.shape[0] > 1:
             img = np.expand_dims(img, 0)
 
@@ -61,7 +395,10 @@ class DWSDetector:
 
         y_mulity = int(np.ceil(img.shape[1] / 160.0))
         x_mulity = int(np.ceil(img.shape[2] / 160.0))
-        if "realistic" not in self.model_path:
+        if pool is not None:
+            canv = pool.get([1, y_mulity * 160, x_mulity * 160, 3 if "realistic" in self.model_path else 1],
+                            img.shape[1:3])
+        elif "realistic" not in self.model_path:
             canv = np.ones([y_mulity * 160, x_mulity * 160], dtype=np.uint8) * 255
             canv = np.expand_dims(np.expand_dims(canv, -1), 0)
         else:
@@ -71,32 +408,132 @@ class DWSDetector:
         canv[0, 0:img.shape[1], 0:img.shape[2]] = img[0]
 
         #Image.fromarray(canv[0]).save(cfg.ROOT_DIR + "/output_images/" + "debug"+ 'input' + '.png')
+        return canv
 
-        pred_energy, pred_class, pred_bbox = self.tf_session.run(
-            [self.network_heads["stamp_energy"][self.energy_loss][-1],
-             self.network_heads["stamp_class"][self.class_loss][-1],
-             self.network_heads["stamp_bbox"][self.bbox_loss][-1]], feed_dict={self.input: canv})
-
+    def run_net(self, canv):
+        """
+        Runs a batch of padded images through the net, returns the energy, class and bounding box maps with the
+        softmax outputs argmaxed (in the graph, see build_output_maps).
+        """
+        with timed(self.timings, "session_run"):
+            pred_energy, pred_class, pred_bbox = self.tf_session.run(
+                [self.energy_map, self.class_map, self.bbox_map], feed_dict={self.input: canv})
 
         #save_debug_panes(pred_energy, pred_class, pred_bbox,self.counter)
         #Image.fromarray(canv[0]).save(cfg.ROOT_DIR + "/output_images/" + "debug"+ 'input' + '.png')
 
-        if self.energy_loss == "softmax":
-            pred_energy = np.argmax(pred_energy, axis=3)
+        return pred_energy, pred_class, pred_bbox
 
-        if self.class_loss == "softmax":
-            pred_class = np.argmax(pred_class, axis=3)
+    def predict_mask(self, img, cutoff=0):
+        """
+        Runs the image through the net and returns only the binarized energy map (energy > cutoff) as a
+        [1, H, W] bool array of the padded image, the thresholding is done in the graph.
+        """
+        return self.tf_session.run(self.energy_mask, feed_dict={self.input: self.prepare_input(img),
+                                                                self.energy_cutoff: cutoff})
 
-        if self.bbox_loss == "softmax":
-            pred_bbox = np.argmax(pred_bbox, axis=3)
 
+def _uses_batch_statistics(graph_def):
+    """
+    True if a batch norm of the GraphDef normalizes with the statistics of the fed batch: a fused batch norm in
+    training mode or the moments of an unfused one.
+    """
+    for node in graph_def.node:
+        if node.op.startswith("FusedBatchNorm"):
+            # is_training defaults to True
+            if "is_training" not in node.attr or node.attr["is_training"].b:
+                return True
+        if "/moments/" in node.name:
+            return True
+    return False
 
-        dws_list = perform_dws(pred_energy, pred_class, pred_bbox, cutoff, min_ccoponent_size)
-        #save_images(canv, dws_list, True, False, self.counter)
 
-        self.counter += 1
+def _tile_ranges(length, tile_size, tile_overlap):
+    """
+    Splits [0, length) into overlapping tiles.
+    returns:
+        list of (start, end, core_start, core_end), the cores partition [0, length)
+    """
+    if length <= tile_size:
+        return [(0, length, 0, length)]
+    starts = list(range(0, length - tile_size + 1, tile_size - tile_overlap))
+    if starts[-1] + tile_size < length:
+        starts.append(length - tile_size)
 
-        return dws_list
+    # neighbouring cores meet in the middle of the overlap
+    bounds = [0] + [(start + tile_size + next_start) // 2 for start, next_start in zip(starts[:-1], starts[1:])] + [length]
+    return [(start, start + tile_size, bounds[nr], bounds[nr + 1]) for nr, start in enumerate(starts)]
+
+
+def _coarse_cells(mask, shape, scale):
+    """
+    Marks the 160 x 160 cells of the padded canvas of an image of the given shape that contain a foreground pixel of
+    mask, the coarse mask of the image scaled by scale.
+    returns:
+        [H / 160, W / 160] bool array
+    """
+    cells = np.zeros((int(np.ceil(shape[0] / 160.0)), int(np.ceil(shape[1] / 160.0))), dtype=bool)
+    # objects that only partly cover a coarse pixel can vanish in the downscaling, so the mask is grown by one pixel
+    ys, xs = np.nonzero(ndimage.binary_dilation(mask, np.ones((3, 3), dtype=bool)))
+    # a coarse pixel covers 1 / scale pixels of the image, every cell it touches is marked
+    for y, x in [(ys / scale, xs / scale), ((ys + 1) / scale - 1, xs / scale),
+                 (ys / scale, (xs + 1) / scale - 1), ((ys + 1) / scale - 1, (xs + 1) / scale - 1)]:
+        cells[np.clip((y // 160).astype(int), 0, cells.shape[0] - 1),
+              np.clip((x // 160).astype(int), 0, cells.shape[1] - 1)] = True
+    return cells
+
+
+def _ink_cells(canv, tolerance, max_ink):
+    """
+    Marks the 160 x 160 cells of a [1, H, W, C] canvas with more than max_ink pixels that differ by more than
+    tolerance from white.
+    returns:
+        [H / 160, W / 160] bool array
+    """
+    ink = np.abs(canv[0].astype(np.int16) - 255) > tolerance
+    ink = ink.reshape(canv.shape[1] // 160, 160, canv.shape[2] // 160, 160, canv.shape[3])
+    return ink.sum(axis=(1, 3, 4)) > max_ink
+
+
+def _cell_crops(cells, context_cells):
+    """
+    Groups the marked cells, cells within 2 * context_cells of each other are grouped, groups whose crops overlap are
+    merged.
+    returns:
+        list of ((y_0, y_1, x_0, x_1), (core_y_0, core_y_1, core_x_0, core_x_1)) in pixels, the cores cover all
+        marked cells, the crops extend them by context_cells cells on every side (clipped to the canvas)
+    """
+    grown = ndimage.binary_dilation(cells, np.ones((2 * context_cells + 1,) * 2, dtype=bool)) \
+        if context_cells > 0 else cells
+    labels, _ = ndimage.label(grown)
+
+    def crop_of(core):
+        return [max(core[0] - context_cells, 0), min(core[1] + context_cells, cells.shape[0]),
+                max(core[2] - context_cells, 0), min(core[3] + context_cells, cells.shape[1])]
+
+    cores = []
+    for label, (slice_y, slice_x) in enumerate(ndimage.find_objects(labels), 1):
+        group = cells[slice_y, slice_x] & (labels[slice_y, slice_x] == label)
+        rows, cols = np.nonzero(group.any(1))[0], np.nonzero(group.any(0))[0]
+        cores.append([int(slice_y.start + rows[0]), int(slice_y.start + rows[-1] + 1),
+                      int(slice_x.start + cols[0]), int(slice_x.start + cols[-1] + 1)])
+
+    # the bounding boxes of distinct groups can overlap, such crops are run once
+    merged = True
+    while merged:
+        merged = False
+        for a in range(len(cores)):
+            for b in range(a + 1, len(cores)):
+                crop_a, crop_b = crop_of(cores[a]), crop_of(cores[b])
+                if crop_a[0] < crop_b[1] and crop_b[0] < crop_a[1] and crop_a[2] < crop_b[3] and crop_b[2] < crop_a[3]:
+                    cores[a] = [min(cores[a][0], cores[b][0]), max(cores[a][1], cores[b][1]),
+                                min(cores[a][2], cores[b][2]), max(cores[a][3], cores[b][3])]
+                    del cores[b]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [(tuple(160 * c for c in crop_of(core)), tuple(160 * c for c in core)) for core in cores]
 
 
 def get_images(data, gt_boxes=None, gt=False, text=False):
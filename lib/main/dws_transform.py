@@ -5,59 +5,468 @@ import math, random
 from itertools import product
 from utils.ufarray import *
 import numpy as np
-
-def perform_dws(dws_energy, class_map, bbox_map,cutoff=0,min_ccoponent_size=0, return_ccomp_img = False):
-    bbox_list = []
-
+from multiprocessing.pool import ThreadPool
+
+def perform_dws(dws_energy, class_map, bbox_map,cutoff=0,min_ccoponent_size=0, return_ccomp_img = False, nr_strips=1, band_gap=32):
+    """
+    List based wrapper around perform_dws_array, every box is a list [xmin, ymin, xmax, ymax, class].
+    If return_ccomp_img is set, a colorized image of the connected components is returned as well.
+    """
+    if not return_ccomp_img:
+        return perform_dws_array(dws_energy, class_map, bbox_map, cutoff, min_ccoponent_size, nr_strips, band_gap).tolist()
+
+    # label once and render the components for debugging
+    labels = label_components_strips(np.squeeze(dws_energy) > cutoff, nr_strips)
+    bbox_list = component_boxes(labels, np.squeeze(class_map), np.squeeze(bbox_map), min_ccoponent_size).tolist()
+    return bbox_list, colorize_components(labels)
+
+
+def perform_dws_array(dws_energy, class_map, bbox_map, cutoff=0, min_ccoponent_size=0, nr_strips=1, band_gap=32,
+                      return_scores=False, pool=None):
+    """
+    Turns the energy, class and bounding box maps of the net into bounding boxes.
+    inputs:
+        dws_energy - the energy map, pixels with energy above cutoff are foreground
+        class_map - the class map (after argmax)
+        bbox_map - the bounding box size map, last dim holds (height, width)
+        cutoff - the cutoff we do for the energy
+        min_ccoponent_size - components with fewer pixels are dropped
+        nr_strips - if larger than 1 the energy map is labeled in parallel horizontal strips
+        band_gap - only the bounding boxes of horizontal foreground bands separated by at least this many empty rows
+            are processed, 0 processes the whole map
+        return_scores - if set, the energy mass of every component is returned as detection score
+        pool - pool the strips are labeled with, see label_components_strips, if None one ThreadPool is created for
+            all bands of the call
+    returns:
+        boxes - int ndarray of shape [N, 5], rows are [xmin, ymin, xmax, ymax, class]
+        scores - float ndarray of shape [N], only if return_scores is set
+    """
     dws_energy = np.squeeze(dws_energy)
     class_map = np.squeeze(class_map)
     bbox_map = np.squeeze(bbox_map)
 
     # Treshhold and binarize dws energy
-    binar_energy = (dws_energy <= cutoff) * 255
-
-    # get connected components
-    labels, out_img = find_connected_comp(np.transpose(binar_energy)) # works with inverted indices
-    # invert labels dict
-    labels_inv = {}
-    for k, v in labels.items():
-        labels_inv[v] = labels_inv.get(v, [])
-        labels_inv[v].append(k)
-
-
-    # filter components that are too small
-    for key in list(labels_inv):
-        # print(key)
-        # print(len(labels_inv[key]))
-        if len(labels_inv[key]) < min_ccoponent_size:
-            del labels_inv[key]
-
-
-    for key in labels_inv.keys():
-        # add additional dict structure to each component and convert to numpy array
-        labels_inv[key] = dict(pixel_coords=np.asanyarray(labels_inv[key]))
-        # use average over all pixel coordinates
-        labels_inv[key]["center"] = np.average(labels_inv[key]["pixel_coords"],0).astype(int)
-        # mayority vote for class --> transposed
-        labels_inv[key]["class"] = np.bincount(class_map[labels_inv[key]["pixel_coords"][:, 1], labels_inv[key]["pixel_coords"][:, 0]]).argmax()
-        # average for box size --> transposed
-        #labels_inv[key]["bbox_size"] = np.average(bbox_map[labels_inv[key]["pixel_coords"][:, 1], labels_inv[key]["pixel_coords"][:, 0]],0).astype(int)
-        labels_inv[key]["bbox_size"] = np.amax(
-            bbox_map[labels_inv[key]["pixel_coords"][:, 1], labels_inv[key]["pixel_coords"][:, 0]], 0).astype(int)
-
-        # produce bbox element, append to list
-        bbox = []
-        bbox.append(int(np.round(labels_inv[key]["center"][0] - (labels_inv[key]["bbox_size"][1]/2.0), 0))) # xmin
-        bbox.append(int(np.round(labels_inv[key]["center"][1] - (labels_inv[key]["bbox_size"][0]/2.0), 0))) # ymin
-        bbox.append(int(np.round(labels_inv[key]["center"][0] + (labels_inv[key]["bbox_size"][1]/2.0), 0))) # xmax
-        bbox.append(int(np.round(labels_inv[key]["center"][1] + (labels_inv[key]["bbox_size"][0]/2.0), 0))) # ymax
-        bbox.append(int(labels_inv[key]["class"]))
-        bbox_list.append(bbox)
-
-    if return_ccomp_img:
-        return bbox_list, out_img
-    return bbox_list
-
+    binary = dws_energy > cutoff
+    energy_map = dws_energy if return_scores else None
+    own_pool = pool is None and nr_strips > 1
+    if own_pool:
+        pool = ThreadPool(nr_strips)
+    try:
+        if band_gap <= 0:
+            labels = label_components_strips(binary, nr_strips, pool)
+            return component_boxes(labels, class_map, bbox_map, min_ccoponent_size, energy_map=energy_map)
+
+        # get connected components band by band, bands are ordered top to bottom so the boxes keep the raster order
+        box_list = [np.zeros((0, 5), dtype=np.int64)]
+        score_list = [np.zeros(0)]
+        for row_0, row_1, col_0, col_1 in foreground_bands(binary, band_gap):
+            band = (slice(row_0, row_1), slice(col_0, col_1))
+            labels = label_components_strips(binary[band], nr_strips, pool)
+            result = component_boxes(labels, class_map[band], bbox_map[band], min_ccoponent_size, (row_0, col_0),
+                                     None if energy_map is None else energy_map[band])
+            if return_scores:
+                box_list.append(result[0])
+                score_list.append(result[1])
+            else:
+                box_list.append(result)
+    finally:
+        if own_pool:
+            pool.close()
+
+    if return_scores:
+        return np.concatenate(box_list), np.concatenate(score_list)
+    return np.concatenate(box_list)
+
+
+def perform_dws_batch(dws_energy, class_map, bbox_map, cutoff=0, min_ccoponent_size=0, nr_strips=1,
+                      return_scores=False):
+    """
+    Batched version of perform_dws_array. All images are stacked on top of each other, separated by an empty row,
+    and labeled at once in a single label space.
+    inputs:
+        dws_energy - [B, H, W] energy maps
+        class_map - [B, H, W] class maps
+        bbox_map - [B, H, W, 2] bounding box size maps
+        cutoff, min_ccoponent_size, nr_strips, return_scores - see perform_dws_array
+    returns:
+        box_list - list of B int ndarrays of shape [N_b, 5]
+        score_list - list of B float ndarrays of shape [N_b], only if return_scores is set
+    """
+    dws_energy = np.asarray(dws_energy)
+    class_map = np.asarray(class_map)
+    # drop a trailing channel dimension of regression outputs
+    if dws_energy.ndim == 4:
+        dws_energy = dws_energy[..., 0]
+    if class_map.ndim == 4:
+        class_map = class_map[..., 0]
+    nr_images, height, width = dws_energy.shape
+
+    stacked = np.zeros((nr_images, height + 1, width), dtype=bool)
+    stacked[:, :height] = dws_energy > cutoff
+    labels = label_components_strips(stacked.reshape(nr_images * (height + 1), width), nr_strips)
+    labels = labels.reshape(nr_images, height + 1, width)[:, :height]
+
+    boxes, scores, kept_labels = _component_boxes(labels, class_map, bbox_map, min_ccoponent_size,
+                                                  energy_map=dws_energy if return_scores else None)
+
+    # labels are ordered by image, so every image owns a contiguous label range
+    last_label = np.maximum.accumulate(labels.reshape(nr_images, -1).max(1))
+    splits = np.searchsorted(kept_labels, last_label[:-1], side="right")
+    box_list = np.split(boxes, splits)
+    if return_scores:
+        return box_list, np.split(scores, splits)
+    return box_list
+
+
+def foreground_bands(binary, band_gap=32):
+    """
+    Splits a binary map into horizontal bands of foreground rows. Rows are merged into one band unless they are
+    separated by at least band_gap empty rows, no connected component can cross an empty row.
+    inputs:
+        binary - 2d boolean ndarray
+        band_gap - minimal number of empty rows between two bands
+    returns:
+        list of (row_0, row_1, col_0, col_1) bounding boxes of the foreground in every band, ends are exclusive
+    """
+    rows = np.flatnonzero(binary.any(1))
+    if rows.size == 0:
+        return []
+    splits = np.flatnonzero(np.diff(rows) > band_gap)
+    band_starts = rows[np.concatenate([[0], splits + 1])]
+    band_ends = rows[np.concatenate([splits, [rows.size - 1]])] + 1
+
+    bands = []
+    for row_0, row_1 in zip(band_starts, band_ends):
+        cols = np.flatnonzero(binary[row_0:row_1].any(0))
+        bands.append((int(row_0), int(row_1), int(cols[0]), int(cols[-1]) + 1))
+    return bands
+
+
+def component_boxes(labels, class_map, bbox_map, min_ccoponent_size=0, offset=(0, 0), energy_map=None):
+    """
+    Computes size, center, majority class and maximal box size of all components of a label image at once
+    and assembles them into bounding boxes.
+    inputs:
+        labels - label image as returned by label_components
+        class_map - the class map, same shape as labels
+        bbox_map - the bounding box size map, shape of labels + [2]
+        min_ccoponent_size - components with fewer pixels are dropped
+        offset - (row, col) position of the label image on the page, added to the box coordinates
+        energy_map - if given, the energy mass (sum of the energy over the component) is returned as score
+    returns:
+        boxes - int ndarray of shape [N, 5], rows are [xmin, ymin, xmax, ymax, class], ordered by label
+        scores - float ndarray of shape [N], only if energy_map is given
+    """
+    boxes, scores, _ = _component_boxes(labels, class_map, bbox_map, min_ccoponent_size, offset, energy_map)
+    if energy_map is not None:
+        return boxes, scores
+    return boxes
+
+
+def _component_boxes(labels, class_map, bbox_map, min_ccoponent_size=0, offset=(0, 0), energy_map=None):
+    """
+    Implements component_boxes, labels may have leading batch dimensions.
+    returns:
+        boxes, scores (None without energy_map) and the labels of the kept components
+    """
+    statistics = component_statistics(labels, class_map, bbox_map, min_ccoponent_size, offset, energy_map)
+    boxes = assemble_boxes(*statistics[:5])
+    return boxes, statistics[5], statistics[6]
+
+
+def component_statistics(labels, class_map, bbox_map, min_ccoponent_size=0, offset=(0, 0), energy_map=None):
+    """
+    Accumulates the statistics assemble_boxes needs for all components of a label image at once, labels may have
+    leading batch dimensions. See component_boxes for the inputs.
+    returns:
+        sizes, sum_x, sum_y, class_hist, bbox_size - see assemble_boxes
+        scores - energy mass per component, None without energy_map
+        kept_labels - labels of the components which passed the size filter
+    """
+    pixels = np.nonzero(labels)
+    comp = labels[pixels] - 1
+    sizes = np.bincount(comp)
+
+    # filter components that are too small before any other per component work
+    keep = sizes >= min_ccoponent_size
+    kept_labels = np.flatnonzero(keep) + 1
+    nr_comps = kept_labels.size
+    if nr_comps < sizes.size:
+        new_ids = np.cumsum(keep) - 1
+        pixel_keep = keep[comp]
+        pixels = tuple(coords[pixel_keep] for coords in pixels)
+        comp = new_ids[comp[pixel_keep]]
+        sizes = sizes[keep]
+    ys, xs = pixels[-2], pixels[-1]
+
+    sum_x = np.bincount(comp, weights=xs + offset[1], minlength=nr_comps)
+    sum_y = np.bincount(comp, weights=ys + offset[0], minlength=nr_comps)
+
+    # component x class histogram
+    classes = class_map[pixels].astype(np.int64)
+    nr_classes = int(classes.max()) + 1 if classes.size > 0 else 1
+    class_hist = np.bincount(comp * nr_classes + classes, minlength=nr_comps * nr_classes)
+    class_hist = class_hist.reshape(nr_comps, nr_classes)
+
+    # maximum for box size
+    bbox_size = np.full((nr_comps, 2), -np.inf)
+    np.maximum.at(bbox_size, comp, bbox_map[pixels])
+
+    scores = None
+    if energy_map is not None:
+        scores = np.bincount(comp, weights=energy_map[pixels], minlength=nr_comps)
+    return sizes, sum_x, sum_y, class_hist, bbox_size, scores, kept_labels
+
+
+def assemble_boxes(sizes, sum_x, sum_y, class_hist, bbox_size):
+    """
+    Builds bounding boxes from accumulated component statistics.
+    inputs:
+        sizes - number of pixels per component
+        sum_x, sum_y - sum of the pixel coordinates per component
+        class_hist - [N, num_classes] class histogram per component
+        bbox_size - [N, 2] maximal (height, width) per component
+    returns:
+        boxes - int ndarray of shape [N, 5], rows are [xmin, ymin, xmax, ymax, class]
+    """
+    # use average over all pixel coordinates
+    center_x = (sum_x / sizes).astype(int)
+    center_y = (sum_y / sizes).astype(int)
+    # mayority vote for class
+    comp_class = class_hist.argmax(1)
+    bbox_size = bbox_size.astype(int)
+
+    half_width = bbox_size[:, 1] / 2.0
+    half_height = bbox_size[:, 0] / 2.0
+    boxes = np.stack([np.round(center_x - half_width),  # xmin
+                      np.round(center_y - half_height),  # ymin
+                      np.round(center_x + half_width),  # xmax
+                      np.round(center_y + half_height),  # ymax
+                      comp_class], 1)
+    return boxes.reshape(-1, 5).astype(np.int64)
+
+
+class ComponentTree:
+    """
+    Component tree (max-tree) over the quantized energy levels of one page.
+    The nodes of level t are the connected components of energy >= t, every node is contained in exactly one node of
+    level t-1. Pixel statistics are accumulated up the tree once, afterwards the boxes of perform_dws for any cutoff
+    and min_ccoponent_size are read off the nodes of level cutoff+1 without labeling again.
+    """
+    def __init__(self, dws_energy, class_map, bbox_map):
+        dws_energy = np.squeeze(dws_energy)
+        class_map = np.squeeze(class_map)
+        bbox_map = np.squeeze(bbox_map)
+
+        self.max_level = max(int(dws_energy.max()), 0) if dws_energy.size > 0 else 0
+        # nodes of level t are self.level_offsets[t-1] .. self.level_offsets[t]-1
+        self.level_offsets = [0]
+        own_node = np.full(dws_energy.shape, -1, dtype=np.int64)
+        parent_list = []
+        prev_labels = None
+        for level in range(1, self.max_level + 1):
+            labels = label_components(dws_energy >= level)
+            offset = self.level_offsets[-1]
+            nr_nodes = int(labels.max())
+            self.level_offsets.append(offset + nr_nodes)
+
+            at_level = dws_energy == level
+            own_node[at_level] = labels[at_level] - 1 + offset
+
+            # parent is the node of the previous level containing the first pixel of the component
+            ys, xs = np.nonzero(labels)
+            _, first = np.unique(labels[ys, xs], return_index=True)
+            if prev_labels is None:
+                parent_list.append(np.full(nr_nodes, -1, dtype=np.int64))
+            else:
+                parent_list.append(prev_labels[ys[first], xs[first]] - 1 + self.level_offsets[-3])
+            prev_labels = labels
+
+        nr_nodes = self.level_offsets[-1]
+        self.parent = np.concatenate(parent_list) if parent_list else np.zeros(0, dtype=np.int64)
+
+        # statistics of the pixels at the level of each node
+        ys, xs = np.nonzero(own_node >= 0)
+        node = own_node[ys, xs]
+        self.sizes = np.bincount(node, minlength=nr_nodes)
+        self.sum_x = np.bincount(node, weights=xs, minlength=nr_nodes)
+        self.sum_y = np.bincount(node, weights=ys, minlength=nr_nodes)
+        self.energy_mass = np.bincount(node, weights=dws_energy[ys, xs], minlength=nr_nodes)
+        classes = class_map[ys, xs].astype(np.int64)
+        nr_classes = int(classes.max()) + 1 if classes.size > 0 else 1
+        self.class_hist = np.bincount(node * nr_classes + classes, minlength=nr_nodes * nr_classes)
+        self.class_hist = self.class_hist.reshape(nr_nodes, nr_classes)
+        self.bbox_size = np.full((nr_nodes, 2), -np.inf)
+        np.maximum.at(self.bbox_size, node, bbox_map[ys, xs])
+
+        # accumulate children into parents, top level first
+        for level in range(self.max_level, 1, -1):
+            children = np.arange(self.level_offsets[level - 1], self.level_offsets[level])
+            parents = self.parent[children]
+            np.add.at(self.sizes, parents, self.sizes[children])
+            np.add.at(self.sum_x, parents, self.sum_x[children])
+            np.add.at(self.sum_y, parents, self.sum_y[children])
+            np.add.at(self.energy_mass, parents, self.energy_mass[children])
+            np.add.at(self.class_hist, parents, self.class_hist[children])
+            np.maximum.at(self.bbox_size, parents, self.bbox_size[children])
+
+    def get_boxes(self, cutoff=0, min_ccoponent_size=0, return_scores=False):
+        """
+        Returns the same boxes (and scores) as perform_dws_array with the given cutoff and min_ccoponent_size.
+        cutoff can also be a sequence indexed by class, then every class uses its own cutoff.
+        """
+        if np.ndim(cutoff) > 0:
+            cutoff = np.asarray(cutoff)
+            box_list = [np.zeros((0, 5), dtype=np.int64)]
+            score_list = [np.zeros(0)]
+            for class_cutoff in np.unique(cutoff):
+                boxes, scores = self.get_boxes(class_cutoff, min_ccoponent_size, return_scores=True)
+                class_mask = cutoff[boxes[:, 4]] == class_cutoff
+                box_list.append(boxes[class_mask])
+                score_list.append(scores[class_mask])
+            if return_scores:
+                return np.concatenate(box_list), np.concatenate(score_list)
+            return np.concatenate(box_list)
+
+        if cutoff < 0:
+            raise ValueError("ComponentTree only supports cutoffs >= 0")
+        level = int(cutoff) + 1
+        nodes = np.arange(self.level_offsets[min(level, self.max_level + 1) - 1],
+                          self.level_offsets[min(level, self.max_level)])
+        nodes = nodes[self.sizes[nodes] >= min_ccoponent_size]
+        boxes = assemble_boxes(self.sizes[nodes], self.sum_x[nodes], self.sum_y[nodes], self.class_hist[nodes],
+                               self.bbox_size[nodes])
+        if return_scores:
+            return boxes, self.energy_mass[nodes]
+        return boxes
+
+    def sweep(self, cutoffs, min_sizes):
+        """
+        Returns a dict mapping every (cutoff, min_ccoponent_size) combination to its boxes, per class cutoffs are
+        keyed as tuples.
+        """
+        return dict(((cutoff if np.ndim(cutoff) == 0 else tuple(cutoff), min_size), self.get_boxes(cutoff, min_size))
+                    for cutoff in cutoffs for min_size in min_sizes)
+
+
+def label_components(binary):
+    """
+    Labels the 8-connected components of a binary image with a two-pass run-length algorithm.
+    Runs of foreground pixels are extracted row by row, runs in adjacent rows which touch (diagonals included)
+    are marked as equivalent and the equivalences are resolved with an array based union find.
+    inputs:
+        binary - 2d ndarray, nonzero entries are foreground
+    returns:
+        labels - int32 ndarray of the same shape, 0 is background, components are numbered 1..N in raster order
+            of their first pixel
+    """
+    binary = np.asarray(binary) != 0
+    height, width = binary.shape
+    if height == 0 or width == 0:
+        return np.zeros((height, width), dtype=np.int32)
+
+    # run extraction on the flattened image, a background column after every row keeps runs inside their row,
+    # so the flat index of a pixel is row * stride + col and run ends are exclusive
+    stride = width + 1
+    padded = np.zeros((height, stride), dtype=bool)
+    padded[:, :width] = binary
+    flat = padded.ravel()
+    is_start = flat.copy()
+    is_start[1:] &= ~flat[:-1]
+    is_end = np.zeros_like(flat)
+    is_end[1:] = flat[:-1] & ~flat[1:]
+    start_key = np.flatnonzero(is_start)
+    end_key = np.flatnonzero(is_end)
+    nr_runs = start_key.size
+    if nr_runs == 0:
+        return np.zeros((height, width), dtype=np.int32)
+
+    # runs are sorted in raster order, so the runs of row r-1 touching a run [s, e) of row r are the contiguous
+    # range of runs whose end lies at or after s and whose start lies at or before e
+    lo = np.searchsorted(end_key, start_key - stride, side="left")
+    hi = np.searchsorted(start_key, end_key - stride, side="right")
+    nr_touching = np.maximum(hi - lo, 0)
+
+    run_b = np.repeat(np.arange(nr_runs), nr_touching)
+    first = np.repeat(lo, nr_touching)
+    offsets = np.arange(run_b.size) - np.repeat(np.cumsum(nr_touching) - nr_touching, nr_touching)
+    run_a = first + offsets
+
+    # second pass, every run takes the label of the first run of its component
+    roots = resolve_equivalences(nr_runs, run_a, run_b)
+    is_root = roots == np.arange(nr_runs)
+    run_label = (np.cumsum(is_root)[roots]).astype(np.int32)
+
+    # paint runs into the label image, the flat image alternates between background gaps and runs
+    bounds = np.empty(2 * nr_runs + 2, dtype=np.int64)
+    bounds[0] = 0
+    bounds[1:-1:2] = start_key
+    bounds[2:-1:2] = end_key
+    bounds[-1] = flat.size
+    values = np.zeros(2 * nr_runs + 1, dtype=np.int32)
+    values[1::2] = run_label
+    labels = np.repeat(values, np.diff(bounds)).reshape(height, stride)
+    return labels[:, :width]
+
+
+def label_components_strips(binary, nr_strips=1, pool=None):
+    """
+    Labels a binary image in horizontal strips in parallel and merges the labels across the strip seams,
+    the result is identical to label_components on the whole image.
+    inputs:
+        binary - 2d ndarray, nonzero entries are foreground
+        nr_strips - number of horizontal strips
+        pool - object with a map method (multiprocessing Pool or ThreadPool), a ThreadPool is used if None
+    returns:
+        labels - int32 ndarray of the same shape, see label_components
+    """
+    binary = np.asarray(binary) != 0
+    nr_strips = min(nr_strips, binary.shape[0])
+    if nr_strips <= 1:
+        return label_components(binary)
+
+    bounds = np.linspace(0, binary.shape[0], nr_strips + 1).astype(int)
+    strips = [binary[bounds[i]:bounds[i + 1]] for i in range(nr_strips)]
+    map_pool = ThreadPool(nr_strips) if pool is None else pool
+    strip_labels = map_pool.map(label_components, strips)
+
+    # move every strip into its own label range
+    offsets = np.cumsum([0] + [int(labels.max()) for labels in strip_labels])
+
+    # equivalences between the last row of a strip and the first row of the next one
+    seam_a = []
+    seam_b = []
+    for i in range(nr_strips - 1):
+        top = strip_labels[i][-1]
+        bottom = strip_labels[i + 1][0]
+        for shift in (-1, 0, 1):
+            a = top[max(shift, 0):len(top) + min(shift, 0)]
+            b = bottom[max(-shift, 0):len(bottom) + min(-shift, 0)]
+            touching = (a > 0) & (b > 0)
+            seam_a.append(a[touching] + offsets[i])
+            seam_b.append(b[touching] + offsets[i + 1])
+
+    # labels are ordered by their first pixel, so the smallest label of a set is the raster first component
+    roots = resolve_equivalences(offsets[-1] + 1, np.concatenate(seam_a), np.concatenate(seam_b))
+    is_root = roots == np.arange(offsets[-1] + 1)
+    is_root[0] = False
+    lut = np.cumsum(is_root)[roots].astype(np.int32)
+
+    # relabel every strip through its part of the lookup table
+    strip_luts = []
+    for i in range(nr_strips):
+        strip_lut = lut[offsets[i]:offsets[i + 1] + 1].copy()
+        strip_lut[0] = 0
+        strip_luts.append(strip_lut)
+    strip_labels = map_pool.map(_relabel_strip, zip(strip_luts, strip_labels))
+    if pool is None:
+        map_pool.close()
+    return np.concatenate(strip_labels)
+
+
+def _relabel_strip(args):
+    strip_lut, labels = args
+    return strip_lut[labels]
 
 
 def get_class(component,class_map):
@@ -164,12 +573,6 @@ def find_connected_comp(input):
 
     uf.flatten()
 
-    colors = {}
-
-    # Image to display the components in a nice, colorful way
-    output_img = Image.new("RGB", (width, height))
-    outdata = output_img.load()
-
     for (x, y) in labels:
 
         # Name of the component the current point belongs to
@@ -178,11 +581,18 @@ def find_connected_comp(input):
         # Update the labels with correct information
         labels[(x, y)] = component
 
-        # Associate a random color with this component
-        if component not in colors:
-            colors[component] = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-
-        # Colorize the image
-        outdata[x, y] = colors[component]
-
-    return (labels, output_img)
\ No newline at end of file
+    return labels
+
+
+def colorize_components(labels):
+    """
+    Debug rendering of a label image, every component gets a random color, the background stays black.
+    inputs:
+        labels - label image as returned by label_components
+    returns:
+        output_img - RGB PIL image of the same size
+    """
+    # color lookup table indexed by label
+    colors = np.random.randint(0, 256, size=(int(labels.max()) + 1, 3)).astype(np.uint8)
+    colors[0] = 0
+    return Image.fromarray(colors[labels], "RGB")
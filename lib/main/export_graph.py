@@ -0,0 +1,87 @@
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+import tensorflow as tf
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector
+from main.inference import load_image
+from main.config import cfg
+import argparse
+import time
+
+
+def mismatch_fraction(maps, other_maps, rtol=1e-3, atol=1e-3):
+    """
+    Fraction of the elements of the energy, class and bbox maps that differ by more than the tolerances.
+    """
+    mismatches = sum(np.sum(~np.isclose(a.astype(np.float64), b.astype(np.float64), rtol=rtol, atol=atol))
+                     for a, b in zip(maps, other_maps))
+    return mismatches / float(sum(a.size for a in maps))
+
+
+def main(parsed):
+    """
+    Builds the inference-only graph (only the heads named by energy_loss, class_loss and bbox_loss), restores the
+    checkpoint and writes it as a frozen GraphDef that DWSDetector loads with frozen_graph=<file>. With --check the
+    outputs of the frozen graph on a page of the test set are compared to the checkpoint detector as inference.py
+    builds it (is_training=True), the file is only written if they match.
+    """
+    parsed = parsed[0]
+    if parsed.optimize == "True" and parsed.is_training == "True":
+        raise ValueError("--optimize folds the batch norms into the convolutions, this needs --is_training False")
+    imdb = get_imdb(parsed.test_set)
+    net = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                      is_training=parsed.is_training == "True", uint8_input=parsed.uint8_input == "True")
+
+    output_file = parsed.output_file
+    if output_file is None:
+        output_file = os.path.join(cfg.ROOT_DIR, parsed.model_path, parsed.saved_net + "_frozen.pb")
+    tmp_file = output_file + ".tmp"
+    net.export_frozen_graph(tmp_file, optimize=parsed.optimize == "True")
+
+    # startup time of the exported graph
+    start_time = time.time()
+    frozen = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, frozen_graph=tmp_file)
+    print("frozen graph loaded in {:.2f}s".format(time.time() - start_time))
+
+    if parsed.check == "True":
+        reference = net
+        if parsed.is_training != "True":
+            # the detector the frozen graph replaces, in its own graph next to the exported net
+            with tf.Graph().as_default():
+                reference = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed,
+                                        individual_upsamp=parsed.individual_upsamp, uint8_input=parsed.uint8_input == "True")
+        im = load_image(imdb, parsed.check_image, parsed.model_path, parsed.scaling)
+        mismatch = mismatch_fraction(reference.predict_maps(im), frozen.predict_maps(im))
+        print("{:.5f} of the outputs differ from the checkpoint detector".format(mismatch))
+        if mismatch > parsed.max_mismatch:
+            os.remove(tmp_file)
+            raise RuntimeError("the frozen graph does not reproduce the checkpoint detector ({:.5f} of the outputs "
+                               "differ), not written. Batch norms with is_training False use the moving statistics, "
+                               "which are only valid if training updated them".format(mismatch))
+    os.rename(tmp_file, output_file)
+    print("written to " + output_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset the net was trained for, only used for the number of classes")
+    parser.add_argument("--model_path", type=str, default="experiments/music/pretrain_lvl_semseg/RefineNet-Res152/run_0", help="directory of the checkpoint, relative to the root directory")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res152", help="type of resnet used (RefineNet-Res152/101/50)")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--is_training", type=str, default="True", help="batch norm mode of the exported graph, True (batch statistics) as DWSDetector uses it, False (moving statistics) is needed by --optimize")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, export a graph with a uint8 input, cast and padding happen in the graph")
+    parser.add_argument("--optimize", type=str, default="False", help="if set to True, fold batch norms, strip pass-through ops and merge the head convolutions, see benchmark_graph.py")
+    parser.add_argument("--check", type=str, default="True", help="if set to True, compare the outputs of the frozen graph to the checkpoint detector and only write it if they match")
+    parser.add_argument("--check_image", type=int, default=0, help="index of the test set image used by --check")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to the image used by --check")
+    parser.add_argument("--max_mismatch", type=float, default=1e-3, help="maximum fraction of differing outputs accepted by --check")
+    parser.add_argument("--output_file", type=str, default=None, help="file the frozen GraphDef is written to, defaults to <model_path>/<saved_net>_frozen.pb")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
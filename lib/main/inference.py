@@ -9,14 +9,38 @@ sys.path.insert(0, os.path.dirname(__file__)[:-4])
 import pdb
 from datasets.factory import get_imdb
 from main.dws_detector import DWSDetector
+from main.dws_transform import perform_dws_array
+from main.pipeline import InferencePipeline
+from main.detection_cache import DetectionCache, weights_fingerprint
+from main.detection_log import DetectionLog
 from main.config import cfg
+from utils.timer import TimingRegistry, timed
 import argparse
 import time
 
 
+# energy cutoff and minimum component size of the watershed post-processing
+DWS_CUTOFF = 1
+DWS_MIN_SIZE = 4
+
+
 def main(parsed):
     parsed = parsed[0]
     imdb = get_imdb(parsed.test_set)
+    path = experiment_path(parsed)
+    if not parsed.debug:
+        net = DWSDetector(imdb=imdb, path=path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                          frozen_graph=parsed.frozen_graph, uint8_input=parsed.uint8_input == "True")
+
+        all_boxes = test_net(net, imdb, parsed, path)
+    else:
+        all_boxes = test_net(False, imdb, parsed, path, parsed.debug)
+
+
+def experiment_path(parsed):
+    """
+    Directory of the net relative to the root directory, given by the dataset, net type and net id.
+    """
     if parsed.dataset == 'DeepScores':
         path = os.path.join("/experiments/music/pretrain_lvl_semseg", parsed.net_type, parsed.net_id)
     elif parsed.dataset == "DeepScores_300dpi":
@@ -27,12 +51,7 @@ def main(parsed):
         path = os.path.join("/experiments/realistic/pretrain_lvl_semseg", parsed.net_type, parsed.net_id)
     elif parsed.dataset == "VOC":
         path = os.path.join("/experiments/realistic/pretrain_lvl_class", parsed.net_type, parsed.net_id)
-    if not parsed.debug:
-        net = DWSDetector(imdb=imdb, path=path, pa=parsed, individual_upsamp=parsed.individual_upsamp)
-
-        all_boxes = test_net(net, imdb, parsed, path)
-    else:
-        all_boxes = test_net(False, imdb, parsed, path, parsed.debug)
+    return path
 
 
 def test_net(net, imdb, parsed, path, debug=False):
@@ -54,39 +73,38 @@ def test_net(net, imdb, parsed, path, debug=False):
 
     print(num_images)
 
-    total_time = []
-    if not debug:
-        for i in range(num_images):
-            start_time = time.time()
-            if i%500 == 0:
-                print(i)
-            if "realistic" not in path:
-                im = Image.open(imdb.image_path_at(i)).convert('L')
+    # with a detection log, detections are appended per page and a rerun only processes the missing pages
+    log = None
+    if parsed.detection_log is not None:
+        # a log is only resumed with the weights and settings it was written with
+        log = DetectionLog(parsed.detection_log, log_header(net.weights_file, parsed) if not debug else None)
+    pages = [i for i in range(num_images) if log is None or i not in log.completed]
+    if log is not None:
+        print("{} of {} pages already in the detection log".format(num_images - len(pages), num_images))
+
+    timings = TimingRegistry()
+
+    def record(i, boxes, scores):
+        with timed(timings, "rescale"):
+            detections = page_detections(boxes, scores, parsed)
+        with timed(timings, "accumulate"):
+            if log is not None:
+                log.append(i, detections)
             else:
-                im = Image.open(imdb.image_path_at(i))
-            im = np.asanyarray(im)
-            im = cv2.resize(im, None, None, fx=parsed.scaling, fy=parsed.scaling, interpolation=cv2.INTER_LINEAR)
-            if im.shape[0]*im.shape[1]>3837*2713:
-                continue
-
-            boxes = net.classify_img(im, 1, 4)
-            if len(boxes) > 800:
-                boxes = []
-            no_objects = len(boxes)
-            for j in range(len(boxes)):
-                # invert scaling for Boxes
-                boxes[j] = np.array(boxes[j])
-                boxes[j][:-1] = (boxes[j][:-1] * (1 / parsed.scaling)).astype(np.int)
-
-                class_of_symbol = boxes[j][4]
-                all_boxes[class_of_symbol][i].append(np.array(boxes[j]))
-            end_time = time.time()
-            total_time.append(end_time - start_time)
-        print(total_time)
-        sum_time = 0
-        for t in total_time: sum_time += t
-        print(sum_time)
+                add_detections(all_boxes, i, detections)
+
+    if not debug:
+        wall_time = detect_pages(net, imdb, parsed, path, pages, record, timings)
+        timings.print_report(len(pages), wall_time)
+        if parsed.timings_file is not None:
+            timings.dump(parsed.timings_file, len(pages), wall_time)
 
+    if log is not None:
+        # the log replaces detections.pkl, evaluation reads it back in one sequential pass
+        all_boxes = log.all_boxes(imdb.num_classes, num_images)
+        log.close()
+
+    elif not debug:
         # convert to np array
         for i1 in range(len(all_boxes)):
             for i2 in range(len(all_boxes[i1])):
@@ -106,6 +124,179 @@ def test_net(net, imdb, parsed, path, debug=False):
     return all_boxes
 
 
+def detect_pages(net, imdb, parsed, path, pages, record, timings=None):
+    """
+    Runs the detector on the given pages of the imdb, record(i, boxes, scores) is called once per page in the order
+    of pages, boxes are in the coordinates of the scaled image. The stages of every page are measured in the
+    TimingRegistry timings if given, "page" is the time per page (between two results for the pipeline).
+    returns:
+        the wall time in seconds
+    """
+    net.timings = timings
+    cache = None
+    if parsed.cache_dir is not None:
+        cache = DetectionCache(parsed.cache_dir, parsed.cache_size * 1024 ** 2)
+        fingerprint = weights_fingerprint(net.weights_file)
+        settings = detection_settings(parsed)
+
+    def load_stage(i):
+        # cached pages are neither loaded nor run through the net
+        key = None
+        if cache is not None:
+            with timed(timings, "cache_lookup"):
+                key = cache.key(imdb.image_path_at(i), fingerprint, settings)
+                detections = cache.get(key)
+            if detections is not None:
+                return key, None, detections
+        return key, load_image(imdb, i, path, parsed.scaling, timings), None
+
+    def net_stage(data):
+        key, im, detections = data
+        return predict_maps(net, im, parsed) if detections is None else None
+
+    def post_stage(i, data, maps):
+        key, im, detections = data
+        if detections is None:
+            with timed(timings, "dws"):
+                detections = dws_maps(maps)
+            if cache is not None:
+                with timed(timings, "cache_store"):
+                    cache.put(key, *detections)
+        with timed(timings, "top_k"):
+            return keep_top_detections(detections[0], detections[1], parsed)
+
+    wall_start_time = time.time()
+    if parsed.pipeline == "True":
+        # overlap image loading, session runs and post-processing of different pages
+        runner = InferencePipeline(load_stage, net_stage, post_stage,
+                                   queue_size=parsed.queue_size, nr_post_workers=parsed.post_workers)
+        start_time = time.time()
+        for i, (boxes, scores) in runner.run(pages):
+            if i%500 == 0:
+                print(i)
+            record(i, boxes, scores)
+            end_time = time.time()
+            if timings is not None:
+                timings.add("page", end_time - start_time)
+            start_time = end_time
+        print("stage utilization: " + ", ".join("{} {:.2f}".format(stage, u) for stage, u in sorted(runner.utilization().items())))
+
+    for i in (pages if parsed.pipeline != "True" else []):
+        with timed(timings, "page"):
+            if i%500 == 0:
+                print(i)
+            data = load_stage(i)
+            boxes, scores = post_stage(i, data, net_stage(data))
+            record(i, boxes, scores)
+    wall_time = time.time() - wall_start_time
+    print(net.stats())
+    if cache is not None:
+        print(cache.stats())
+    return wall_time
+
+
+def detection_settings(parsed):
+    """
+    The settings that change the detections of a page before the top k selection, they are part of the cache key.
+    """
+    settings = dict(scaling=float(parsed.scaling), cutoff=DWS_CUTOFF, min_size=DWS_MIN_SIZE,
+                    uint8_input=parsed.uint8_input == "True", max_untiled_pixels=parsed.max_untiled_pixels,
+                    tile_size=parsed.tile_size, tile_overlap=parsed.tile_overlap,
+                    # the net is built with every loss variant of a head, one checkpoint serves all of them
+                    energy_loss=parsed.energy_loss, class_loss=parsed.class_loss, bbox_loss=parsed.bbox_loss,
+                    individual_upsamp=parsed.individual_upsamp)
+    if getattr(parsed, "coarse_to_fine", "False") == "True":
+        settings.update(coarse_to_fine=True, coarse_scale=parsed.coarse_scale, coarse_cutoff=parsed.coarse_cutoff,
+                        coarse_context=parsed.coarse_context, coarse_max_fraction=parsed.coarse_max_fraction)
+    if getattr(parsed, "skip_blank", "False") == "True":
+        settings.update(skip_blank=True, blank_tolerance=parsed.blank_tolerance, blank_max_ink=parsed.blank_max_ink,
+                        blank_context=parsed.blank_context, coarse_max_fraction=parsed.coarse_max_fraction)
+    return settings
+
+
+def log_header(weights_file, parsed):
+    """
+    Header of a detection log, the fingerprint of the weights and the detection settings.
+    """
+    return dict(fingerprint=weights_fingerprint(weights_file), settings=detection_settings(parsed))
+
+
+def load_image(imdb, i, path, scaling, timings=None):
+    """
+    Loads image i of the imdb, converts it to grayscale (except for realistic images) and applies the scaling.
+    The load (including decoding), grayscale and resize stages are measured in timings if given.
+    """
+    with timed(timings, "load"):
+        im = Image.open(imdb.image_path_at(i))
+        im.load()
+    with timed(timings, "grayscale"):
+        if "realistic" not in path:
+            im = im.convert('L')
+        im = np.asanyarray(im)
+    with timed(timings, "resize"):
+        im = cv2.resize(im, None, None, fx=scaling, fy=scaling, interpolation=cv2.INTER_LINEAR)
+    return im
+
+
+def predict_maps(net, im, parsed):
+    """
+    Runs the net on one image, oversized images are run in tiles to bound the memory used by the activations. With
+    coarse_to_fine set, the net only runs at full resolution around the regions found by a low resolution pass, with
+    skip_blank set only around the cells that contain ink.
+    """
+    if im.shape[0]*im.shape[1] > parsed.max_untiled_pixels:
+        return net.predict_maps_tiled(im, parsed.tile_size, parsed.tile_overlap)
+    if getattr(parsed, "coarse_to_fine", "False") == "True":
+        return net.predict_maps_coarse_to_fine(im, parsed.coarse_scale, parsed.coarse_cutoff, parsed.coarse_context,
+                                               parsed.coarse_max_fraction)
+    if getattr(parsed, "skip_blank", "False") == "True":
+        return net.predict_maps_skip_blank(im, parsed.blank_tolerance, parsed.blank_max_ink, parsed.blank_context,
+                                           parsed.coarse_max_fraction)
+    return net.predict_maps(im)
+
+
+def postprocess_maps(maps, parsed):
+    """
+    Turns the maps of the net into boxes and scores, keeps the top k detections by score.
+    """
+    boxes, scores = dws_maps(maps)
+    return keep_top_detections(boxes, scores, parsed)
+
+
+def dws_maps(maps):
+    """
+    Runs the watershed post-processing with the cutoff and min component size used for evaluation.
+    """
+    return perform_dws_array(maps[0], maps[1], maps[2], DWS_CUTOFF, DWS_MIN_SIZE, return_scores=True)
+
+
+def keep_top_detections(boxes, scores, parsed):
+    """
+    Keeps the max_detections detections with the highest score.
+    """
+    if len(boxes) > parsed.max_detections:
+        keep = np.argsort(-scores, kind="stable")[:parsed.max_detections]
+        boxes, scores = boxes[keep], scores[keep]
+    return boxes, scores
+
+
+def page_detections(boxes, scores, parsed):
+    """
+    Inverts the scaling of the boxes of a page, returns the [N, 6] array [x1, y1, x2, y2, class, score] of the detection log.
+    """
+    boxes = np.asarray(boxes).reshape(-1, 5)
+    coordinates = (boxes[:, :4] * (1 / parsed.scaling)).astype(int)
+    return np.concatenate([coordinates, boxes[:, 4:5], np.asarray(scores).reshape(-1, 1)], 1)
+
+
+def add_detections(all_boxes, i, detections):
+    """
+    Appends the [N, 6] detections of image i (see page_detections) to all_boxes[class][i] as [x1, y1, x2, y2, score].
+    """
+    for det in detections:
+        all_boxes[int(det[4])][i].append(det[[0, 1, 2, 3, 5]])
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("--scaling", type=int, default=.5, help="scale factor applied to images after loading")
@@ -132,6 +323,29 @@ if __name__ == '__main__':
     parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
     parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
     parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss, must be reg aka regression")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--frozen_graph", type=str, default=None, help="if set, the net is loaded from this frozen GraphDef (see export_graph.py) instead of the checkpoint")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, images are fed as uint8 and cast and padded in the graph")
+    parser.add_argument("--max_detections", type=int, default=800, help="maximum number of detections kept per image, the ones with the highest score are kept")
+    parser.add_argument("--max_untiled_pixels", type=int, default=3837*2713, help="images with more pixels (after scaling) are run through the net in tiles, tiled outputs differ from whole page ones, see benchmark_tiling.py")
+    parser.add_argument("--tile_size", type=int, default=1280, help="side length of the tiles used for oversized images, multiple of 160")
+    parser.add_argument("--tile_overlap", type=int, default=320, help="overlap of neighbouring tiles, multiple of 160")
+    parser.add_argument("--coarse_to_fine", type=str, default="False", help="if set to True, a low resolution pass of the energy head finds the regions with objects and only these are run at full resolution. Lossy, the maps differ from a single pass, see benchmark_coarse_to_fine.py")
+    parser.add_argument("--coarse_scale", type=float, default=.25, help="scale of the low resolution pass relative to the scaled image")
+    parser.add_argument("--coarse_cutoff", type=int, default=0, help="energy cutoff of the low resolution pass, cells with higher energy are run at full resolution")
+    parser.add_argument("--coarse_context", type=int, default=160, help="context in pixels run around the regions found, rounded up to multiples of 160")
+    parser.add_argument("--coarse_max_fraction", type=float, default=.6, help="if the regions found (by coarse_to_fine or skip_blank) cover more of the page, the whole page is run")
+    parser.add_argument("--skip_blank", type=str, default="False", help="if set to True, the net only runs around the 160 x 160 cells of the page that contain ink, blank cells get no detections. The cells that are run can differ from a single pass, see benchmark_coarse_to_fine.py")
+    parser.add_argument("--blank_tolerance", type=int, default=0, help="pixels that differ by at most this from white count as blank, values above 0 trade accuracy (faint strokes are skipped) for speed")
+    parser.add_argument("--blank_max_ink", type=int, default=0, help="cells with at most this many non blank pixels are skipped, values above 0 trade accuracy for speed")
+    parser.add_argument("--blank_context", type=int, default=160, help="context in pixels run around the cells with ink, rounded up to multiples of 160")
+    parser.add_argument("--pipeline", type=str, default="False", help="if set to True, image loading, the net and post-processing run as overlapping pipeline stages")
+    parser.add_argument("--queue_size", type=int, default=4, help="size of the queues between the pipeline stages")
+    parser.add_argument("--post_workers", type=int, default=2, help="number of post-processing threads of the pipeline")
+    parser.add_argument("--cache_dir", type=str, default=None, help="if set, the detections of every page are cached in this directory and reused by later runs with the same weights and settings")
+    parser.add_argument("--cache_size", type=int, default=2048, help="maximum size of the detection cache in MB, least recently used pages are evicted")
+    parser.add_argument("--detection_log", type=str, default=None, help="if set, detections are appended page by page to a log in this directory instead of detections.pkl, an interrupted run resumes from the last completed page")
+    parser.add_argument("--timings_file", type=str, default=None, help="if set, the per stage latency percentiles and the throughput are written to this json file")
     parser.add_argument("--debug", type=bool, default=False, help="if set to True, it is in debug mode, and instead of running the images on the net, it only evaluates from a previous run")
 
 
@@ -0,0 +1,109 @@
+from __future__ import print_function
+import numpy as np
+import os
+import io
+import sys
+import json
+import time
+import threading
+import urllib.request
+import urllib.error
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+from PIL import Image
+import argparse
+
+
+def load_payloads(parsed):
+    """
+    Encoded images sent to the server: the files of --image_dir, or synthetic pages with random note-like blobs.
+    """
+    if parsed.image_dir is not None:
+        names = sorted(os.listdir(parsed.image_dir))[:parsed.nr_images]
+        payloads = []
+        for name in names:
+            with open(os.path.join(parsed.image_dir, name), "rb") as f:
+                payloads.append(f.read())
+        return payloads
+
+    rng = np.random.RandomState(parsed.seed)
+    payloads = []
+    for _ in range(parsed.nr_images):
+        page = np.full((parsed.height, parsed.width), 255, dtype=np.uint8)
+        for _ in range(200):
+            y, x = rng.randint(0, parsed.height - 10), rng.randint(0, parsed.width - 10)
+            page[y:y + rng.randint(3, 10), x:x + rng.randint(3, 10)] = 0
+        data = io.BytesIO()
+        Image.fromarray(page).save(data, format="PNG")
+        payloads.append(data.getvalue())
+    return payloads
+
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=payload, headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def main(parsed):
+    """
+    Sends --requests detection requests from --concurrency client threads and reports throughput and latency,
+    together with the metrics the server reports.
+    """
+    parsed = parsed[0]
+    url = "http://{}:{}".format(parsed.host, parsed.port)
+    payloads = load_payloads(parsed)
+
+    latencies = []
+    errors = []
+    next_request = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                nr = next_request[0]
+                next_request[0] += 1
+            if nr >= parsed.requests:
+                return
+            start_time = time.time()
+            try:
+                post(url + "/detect", payloads[nr % len(payloads)])
+            except (urllib.error.URLError, IOError) as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                latencies.append(time.time() - start_time)
+
+    start_time = time.time()
+    threads = [threading.Thread(target=client) for _ in range(parsed.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - start_time
+
+    latencies = np.asarray(latencies) * 1000
+    print("{} requests, {} errors, concurrency {}".format(parsed.requests, len(errors), parsed.concurrency))
+    print("throughput {:.2f} requests/s".format(len(latencies) / wall_time))
+    if len(latencies):
+        print("client latency ms: p50 {:.1f}, p95 {:.1f}, p99 {:.1f}".format(
+            *[np.percentile(latencies, p) for p in [50, 95, 99]]))
+    with urllib.request.urlopen(url + "/metrics") as response:
+        print("server metrics: " + response.read().decode("utf-8"))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address of the server")
+    parser.add_argument("--port", type=int, default=8500, help="port of the server")
+    parser.add_argument("--requests", type=int, default=100, help="total number of requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="number of concurrent clients")
+    parser.add_argument("--image_dir", type=str, default=None, help="directory with the images to send, synthetic pages if not set")
+    parser.add_argument("--nr_images", type=int, default=10, help="number of distinct images sent")
+    parser.add_argument("--height", type=int, default=1000, help="height of the synthetic pages")
+    parser.add_argument("--width", type=int, default=700, help="width of the synthetic pages")
+    parser.add_argument("--seed", type=int, default=314, help="seed for the synthetic pages")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
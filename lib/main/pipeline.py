@@ -0,0 +1,128 @@
+from __future__ import print_function
+import threading
+import time
+import queue
+
+
+class InferencePipeline:
+    """
+    Three stage inference pipeline: decode workers, one network stage and post-processing workers connected by
+    bounded queues, so that decoding, session runs and post-processing of different pages overlap.
+    Results are returned in the order of the input items.
+
+    load_fn(item) -> data           e.g. image decoding, grayscale conversion and resizing
+    net_fn(data) -> net_out         e.g. padding and the session run, always called from the same thread
+    post_fn(item, data, net_out)    e.g. perform_dws and box rescaling
+    """
+    def __init__(self, load_fn, net_fn, post_fn, queue_size=4, nr_loaders=1, nr_post_workers=2):
+        self.load_fn = load_fn
+        self.net_fn = net_fn
+        self.post_fn = post_fn
+        self.queue_size = queue_size
+        self.nr_loaders = nr_loaders
+        self.nr_post_workers = nr_post_workers
+
+        self.busy_time = dict(load=0., net=0., post=0.)
+        self.wall_time = 0.
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        """
+        Generator yielding (item, result) in the order of items.
+        """
+        items = list(items)
+        load_queue = queue.Queue(maxsize=self.queue_size)
+        net_queue = queue.Queue(maxsize=self.queue_size)
+        # bounds the number of items between loading and the consumer, including the reorder buffer
+        in_flight = threading.Semaphore(3 * self.queue_size + self.nr_loaders + self.nr_post_workers + 1)
+        results = dict()
+        results_ready = threading.Condition()
+        errors = []
+        next_item = [0]
+        start_time = time.time()
+
+        def fail(e):
+            with results_ready:
+                errors.append(e)
+                results_ready.notify_all()
+
+        def load_worker():
+            try:
+                while not errors:
+                    in_flight.acquire()
+                    with self._lock:
+                        seq = next_item[0]
+                        next_item[0] += 1
+                    if seq >= len(items):
+                        break
+                    data = self._timed("load", self.load_fn, items[seq])
+                    load_queue.put((seq, data))
+            except Exception as e:
+                fail(e)
+            load_queue.put(None)
+
+        def net_worker():
+            finished_loaders = 0
+            try:
+                while finished_loaders < self.nr_loaders:
+                    job = load_queue.get()
+                    if job is None:
+                        finished_loaders += 1
+                        continue
+                    seq, data = job
+                    net_queue.put((seq, data, self._timed("net", self.net_fn, data)))
+            except Exception as e:
+                fail(e)
+            for _ in range(self.nr_post_workers):
+                net_queue.put(None)
+
+        def post_worker():
+            try:
+                while True:
+                    job = net_queue.get()
+                    if job is None:
+                        break
+                    seq, data, net_out = job
+                    result = self._timed("post", self.post_fn, items[seq], data, net_out)
+                    with results_ready:
+                        results[seq] = result
+                        results_ready.notify_all()
+            except Exception as e:
+                fail(e)
+
+        threads = [threading.Thread(target=load_worker) for _ in range(self.nr_loaders)]
+        threads.append(threading.Thread(target=net_worker))
+        threads += [threading.Thread(target=post_worker) for _ in range(self.nr_post_workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        for seq in range(len(items)):
+            with results_ready:
+                while seq not in results and not errors:
+                    results_ready.wait()
+                if errors:
+                    raise errors[0]
+                result = results.pop(seq)
+            in_flight.release()
+            yield items[seq], result
+
+        for thread in threads:
+            thread.join()
+        self.wall_time += time.time() - start_time
+
+    def utilization(self):
+        """
+        Fraction of the wall time every stage was busy, averaged over the workers of the stage.
+        """
+        if self.wall_time == 0:
+            return dict((stage, 0.) for stage in self.busy_time)
+        workers = dict(load=self.nr_loaders, net=1, post=self.nr_post_workers)
+        return dict((stage, self.busy_time[stage] / (self.wall_time * workers[stage])) for stage in self.busy_time)
+
+    def _timed(self, stage, fp, *args):
+        start_time = time.time()
+        result = fp(*args)
+        with self._lock:
+            self.busy_time[stage] += time.time() - start_time
+        return result
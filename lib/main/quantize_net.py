@@ -0,0 +1,122 @@
+import numpy as np
+import os
+import sys
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+import tensorflow as tf
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector
+from main.inference import load_image, predict_maps, postprocess_maps, page_detections, add_detections
+from models.quantization import quantize_graph_def
+from main.config import cfg
+import argparse
+import time
+
+
+def detect_all(net, imdb, parsed):
+    """
+    Runs the detector over the first max_images images of the imdb.
+    returns:
+        all_boxes as used by imdb.evaluate_detections, the median seconds per image
+    """
+    num_images = len(imdb.image_index)
+    all_boxes = [[[] for _ in range(num_images)] for _ in range(imdb.num_classes)]
+    timings = []
+    for i in range(min(num_images, parsed.max_images)):
+        im = load_image(imdb, i, parsed.model_path, parsed.scaling)
+        start_time = time.time()
+        boxes, scores = postprocess_maps(predict_maps(net, im, parsed), parsed)
+        timings.append(time.time() - start_time)
+        add_detections(all_boxes, i, page_detections(boxes, scores, parsed))
+
+    for i1 in range(len(all_boxes)):
+        for i2 in range(len(all_boxes[i1])):
+            all_boxes[i1][i2] = np.asarray(all_boxes[i1][i2])
+    return all_boxes, np.median(timings)
+
+
+def evaluate(net, imdb, name, parsed):
+    """
+    Evaluates one detector with imdb.evaluate_detections and reads the mAP at IoU 0.5 back from the results file.
+    """
+    all_boxes, seconds = detect_all(net, imdb, parsed)
+    path = os.path.join("/", parsed.model_path, "eval_" + name)
+    if not os.path.isdir("/DeepWatershedDetection" + path):
+        os.makedirs("/DeepWatershedDetection" + path)
+    imdb.evaluate_detections(all_boxes, cfg.OUT_DIR, path)
+    with open("/DeepWatershedDetection" + path + "/res-0.5.txt") as f:
+        mean_ap = float(f.read().strip().split("\n")[-1].split(":")[-1])
+    return mean_ap, seconds
+
+
+def main(parsed):
+    """
+    Exports the checkpoint written by train_dwd (execute_assign) as frozen inference graph and writes a copy with int8
+    convolution kernels (per output channel scales), both can be loaded with DWSDetector(frozen_graph=<file>).
+    Optionally evaluates both graphs and reports the mAP delta, the speedup and the reduction of the weights in the
+    GraphDef, which is a reduction of the file size, not of the memory used at run time.
+    """
+    parsed = parsed[0]
+    if parsed.optimize == "True" and parsed.is_training == "True":
+        raise ValueError("--optimize folds the batch norms into the convolutions, this needs --is_training False")
+    imdb = get_imdb(parsed.test_set)
+    prefix = os.path.join(cfg.ROOT_DIR, parsed.model_path, parsed.saved_net)
+    float_file, int8_file = prefix + "_frozen.pb", prefix + "_int8.pb"
+
+    net = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                      is_training=parsed.is_training == "True")
+    net.export_frozen_graph(float_file, optimize=parsed.optimize == "True")
+    net.sess.close()
+
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(float_file, "rb") as f:
+        graph_def.ParseFromString(f.read())
+    quantized, stats = quantize_graph_def(graph_def, parsed.min_elements)
+    if stats["kernels"] == 0:
+        raise RuntimeError("no kernel of {} was quantized, check --min_elements".format(float_file))
+    with tf.gfile.GFile(int8_file, "wb") as f:
+        f.write(quantized.SerializeToString())
+    print("{} kernels quantized, GraphDef weights {:.1f} MB -> {:.1f} MB, written to {}".format(
+        stats["kernels"], stats["bytes_before"] / 1e6, stats["bytes_after"] / 1e6, int8_file))
+
+    if parsed.evaluate != "True":
+        return
+
+    results = dict()
+    for name, file_name in [("float32", float_file), ("int8", int8_file)]:
+        detector = DWSDetector(imdb=imdb, path=parsed.model_path, pa=parsed, frozen_graph=file_name)
+        results[name] = evaluate(detector, imdb, name, parsed)
+        detector.sess.close()
+
+    print("{:<8s} {:>8s} {:>10s} {:>10s}".format("graph", "mAP@0.5", "s / page", "file MB"))
+    for name, file_name in [("float32", float_file), ("int8", int8_file)]:
+        print("{:<8s} {:8.4f} {:10.3f} {:10.1f}".format(name, results[name][0], results[name][1],
+                                                      os.path.getsize(file_name) / 1e6))
+    # at run time the dequantization is constant folded, the weights only take less space in the file
+    print("mAP delta {:+.4f}, speedup {:.2f}x, GraphDef weights (file size) reduced {:.2f}x".format(
+        results["int8"][0] - results["float32"][0], results["float32"][1] / results["int8"][1],
+        float(stats["bytes_before"]) / stats["bytes_after"]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset to evaluate on")
+    parser.add_argument("--model_path", type=str, default="experiments/music/pretrain_lvl_semseg/RefineNet-Res101/run_0", help="directory of the checkpoint, relative to the root directory")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res101", help="type of resnet used (RefineNet-Res152/101/50)")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--is_training", type=str, default="True", help="batch norm mode of the exported graph, True (batch statistics) as DWSDetector uses it, False (moving statistics) is needed by --optimize")
+    parser.add_argument("--optimize", type=str, default="False", help="if set to True, fold batch norms before quantizing, needs is_training False")
+    parser.add_argument("--min_elements", type=int, default=1024, help="kernels with fewer weights stay float32")
+    parser.add_argument("--evaluate", type=str, default="False", help="if set to True, both graphs are evaluated with imdb.evaluate_detections")
+    parser.add_argument("--max_images", type=int, default=1000000, help="number of images detected for the evaluation, images without detections count as misses")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to images after loading")
+    parser.add_argument("--max_detections", type=int, default=800, help="maximum number of detections kept per image")
+    parser.add_argument("--max_untiled_pixels", type=int, default=3837*2713, help="images with more pixels (after scaling) are run through the net in tiles, tiled outputs differ from whole page ones, see benchmark_tiling.py")
+    parser.add_argument("--tile_size", type=int, default=1280, help="side length of the tiles used for oversized images, multiple of 160")
+    parser.add_argument("--tile_overlap", type=int, default=320, help="overlap of neighbouring tiles, multiple of 160")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
@@ -0,0 +1,219 @@
+from __future__ import print_function
+import numpy as np
+import os
+import io
+import sys
+import json
+import time
+import queue
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+import cv2
+from PIL import Image
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector
+from main.inference import keep_top_detections, page_detections
+import argparse
+
+
+class DynamicBatcher(object):
+    """
+    Coalesces concurrent requests into micro-batches. A batch is closed when it holds max_batch_size items or when
+    its oldest request has waited max_latency seconds, then process_fn(list of items) -> list of results is called
+    from the single worker thread.
+    """
+    def __init__(self, process_fn, max_batch_size=8, max_latency=0.05, history=10000):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.pending = queue.Queue()
+
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+        self.worker = threading.Thread(target=self._work)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, item):
+        """
+        Blocks until the batch containing item has been processed, returns its result.
+        """
+        request = dict(item=item, arrival=time.time(), done=threading.Event(), result=None, error=None)
+        self.pending.put(request)
+        request["done"].wait()
+        if request["error"] is not None:
+            raise request["error"]
+        return request["result"]
+
+    def metrics(self):
+        with self._lock:
+            latencies = np.asarray(self.latencies) * 1000
+            batch_sizes = list(self.batch_sizes)
+            metrics = dict(queue_depth=self.pending.qsize(), requests=self.requests, errors=self.errors,
+                           batches=len(batch_sizes), mean_batch_size=float(np.mean(batch_sizes)) if batch_sizes else 0.)
+        for p in [50, 95, 99]:
+            metrics["latency_p{}_ms".format(p)] = float(np.percentile(latencies, p)) if len(latencies) else 0.
+        return metrics
+
+    def _work(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = batch[0]["arrival"] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                # past the deadline only requests that are already waiting join the batch
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        batch.append(self.pending.get(timeout=timeout))
+                    else:
+                        batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                results = self.process_fn([request["item"] for request in batch])
+                for request, result in zip(batch, results):
+                    request["result"] = result
+            except Exception as e:
+                for request in batch:
+                    request["error"] = e
+
+            end_time = time.time()
+            with self._lock:
+                self.batch_sizes.append(len(batch))
+                for request in batch:
+                    self.requests += 1
+                    self.errors += request["error"] is not None
+                    self.latencies.append(end_time - request["arrival"])
+            for request in batch:
+                request["done"].set()
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+    """
+    POST /detect    body: encoded image (png, jpg, ...), returns {"boxes": [[x1, y1, x2, y2, class, score], ...]}
+    GET  /health    returns {"status": "ok"}
+    GET  /metrics   returns queue depth, request and batch counts and p50/p95/p99 latency
+    """
+    def do_GET(self):
+        if self.path == "/health":
+            self._reply(200, dict(status="ok"))
+        elif self.path == "/metrics":
+            metrics = self.server.batcher.metrics()
+            metrics.update(self.server.detector_stats())
+            self._reply(200, metrics)
+        else:
+            self._reply(404, dict(error="unknown path " + self.path))
+
+    def do_POST(self):
+        if self.path != "/detect":
+            self._reply(404, dict(error="unknown path " + self.path))
+            return
+        try:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            img = self.server.decode(body)
+        except Exception as e:
+            self._reply(400, dict(error="could not decode image: " + str(e)))
+            return
+        try:
+            boxes = self.server.batcher.submit(img)
+        except Exception as e:
+            self._reply(500, dict(error=str(e)))
+            return
+        self._reply(200, dict(boxes=boxes))
+
+    def _reply(self, code, content):
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # one line per request would dominate the output under load
+        pass
+
+
+class DetectionServer(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server around one detector: requests are decoded in their own threads, the net runs micro-batches
+    of them through DWSDetector.classify_images. Requests are only batched if the batch norms of the net use the
+    moving statistics, with batch statistics the boxes of a request would depend on the other requests of its batch.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, net, parsed):
+        HTTPServer.__init__(self, address, DetectionHandler)
+        self.net = net
+        self.parsed = parsed
+        self.scaling = parsed.scaling
+        self.grayscale = "realistic" not in parsed.model_path
+        self.cutoff = parsed.cutoff
+        self.min_size = parsed.min_size
+        max_batch_size = parsed.max_batch_size if not net.batch_statistics else 1
+        self.batcher = DynamicBatcher(self.detect, max_batch_size, parsed.max_latency / 1000.0)
+
+    def decode(self, body):
+        im = Image.open(io.BytesIO(body))
+        if self.grayscale:
+            im = im.convert('L')
+        im = np.asanyarray(im)
+        if self.scaling != 1:
+            im = cv2.resize(im, None, None, fx=self.scaling, fy=self.scaling, interpolation=cv2.INTER_LINEAR)
+        return im
+
+    def detect(self, imgs):
+        results = []
+        for boxes, scores in self.net.classify_images(imgs, self.cutoff, self.min_size, max_batch_size=len(imgs),
+                                                      return_scores=True):
+            detections = page_detections(*keep_top_detections(boxes, scores, self.parsed), parsed=self.parsed)
+            results.append([[int(x) for x in det[:5]] + [float(det[5])] for det in detections])
+        return results
+
+    def detector_stats(self):
+        return self.net.stats()
+
+
+def main(parsed):
+    parsed = parsed[0]
+    net = DWSDetector(imdb=get_imdb(parsed.test_set), path=parsed.model_path, pa=parsed,
+                      individual_upsamp=parsed.individual_upsamp, frozen_graph=parsed.frozen_graph,
+                      uint8_input=parsed.uint8_input == "True")
+    server = DetectionServer((parsed.host, parsed.port), net, parsed)
+    if net.batch_statistics:
+        print("the batch norms use batch statistics, requests are run one by one")
+    print("serving on http://{}:{}".format(parsed.host, parsed.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8500, help="port to listen on")
+    parser.add_argument("--max_batch_size", type=int, default=4, help="maximum number of requests per micro-batch, only used for nets with moving batch norm statistics (frozen graphs exported with --is_training False)")
+    parser.add_argument("--max_latency", type=float, default=50, help="maximum time in ms a request waits for its micro-batch to fill up")
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset the net was trained for, only used for the number of classes")
+    parser.add_argument("--model_path", type=str, default="experiments/music/pretrain_lvl_semseg/RefineNet-Res152/run_0", help="directory of the checkpoint, relative to the root directory")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res152", help="type of resnet used (RefineNet-Res152/101/50)")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--frozen_graph", type=str, default=None, help="if set, the net is loaded from this frozen GraphDef")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, images are fed as uint8 and cast and padded in the graph")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to images after decoding, boxes are returned in original coordinates")
+    parser.add_argument("--cutoff", type=int, default=1, help="energy cutoff")
+    parser.add_argument("--min_size", type=int, default=4, help="minimum connected component size")
+    parser.add_argument("--max_detections", type=int, default=800, help="maximum number of detections returned per image")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
@@ -0,0 +1,145 @@
+from __future__ import print_function
+import os
+import sys
+import time
+import json
+import hashlib
+import multiprocessing
+sys.path.insert(0, os.path.dirname(__file__)[:-4])
+from datasets.factory import get_imdb
+from main.dws_detector import DWSDetector
+from main.inference import detect_pages, page_detections, experiment_path, log_header, detection_settings
+from main.detection_log import DetectionLog, merge_all_boxes
+from main.config import cfg
+from utils.timer import TimingRegistry
+import argparse
+
+
+def shard_pages(num_images, nr_shards, shard):
+    """
+    Pages of a shard, pages are dealt out round robin so that every shard gets a similar mix of page sizes.
+    """
+    return list(range(shard, num_images, nr_shards))
+
+
+def default_output_dir(parsed, path):
+    """
+    OUT_DIR/shards/<experiment path>/<hash of the detection settings and the frozen graph>, so that runs of other nets
+    or with other settings do not pick up the logs of each other.
+    """
+    settings = detection_settings(parsed)
+    settings["frozen_graph"] = parsed.frozen_graph
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cfg.OUT_DIR, "shards", path.strip("/"), digest)
+
+
+def shard_dir(parsed, shard):
+    return os.path.join(parsed.output_dir, "shard_{}_of_{}".format(shard, parsed.nr_shards))
+
+
+def run_shard(shard, parsed, path):
+    """
+    Worker process: loads its own detector (and tensorflow session) with the thread budget of the shard and appends the
+    detections of its pages to the detection log of the shard. Pages already in the log are skipped, so a failed
+    run is resumed by starting it again, a log written with other weights or settings is not resumed. The stage timings of the shard are written to timings.json next to its log.
+    """
+    imdb = get_imdb(parsed.test_set)
+    # the file the detector loads its weights from
+    weights_file = parsed.frozen_graph if parsed.frozen_graph is not None else \
+        cfg.ROOT_DIR + "/" + path + "/" + parsed.saved_net
+    log = DetectionLog(shard_dir(parsed, shard), log_header(weights_file, parsed))
+    pages = [i for i in shard_pages(len(imdb.image_index), parsed.nr_shards, shard) if i not in log.completed]
+    print("shard {}: {} pages to do".format(shard, len(pages)))
+    if pages:
+        net = DWSDetector(imdb=imdb, path=path, pa=parsed, individual_upsamp=parsed.individual_upsamp,
+                          frozen_graph=parsed.frozen_graph, uint8_input=parsed.uint8_input == "True",
+                          intra_op_threads=parsed.intra_op_threads, inter_op_threads=parsed.inter_op_threads)
+        timings = TimingRegistry()
+        wall_time = detect_pages(net, imdb, parsed, path, pages,
+                                 lambda i, boxes, scores: log.append(i, page_detections(boxes, scores, parsed)), timings)
+        timings.dump(os.path.join(shard_dir(parsed, shard), "timings.json"), len(pages), wall_time)
+    log.close()
+
+
+def main(parsed):
+    """
+    Splits the image index of the test set into --nr_shards shards, runs one worker process per shard and merges the
+    detection logs of the shards into all_boxes for imdb.evaluate_detections.
+    """
+    parsed = parsed[0]
+    imdb = get_imdb(parsed.test_set)
+    path = experiment_path(parsed)
+    num_images = len(imdb.image_index)
+    if parsed.output_dir is None:
+        parsed.output_dir = default_output_dir(parsed, path)
+    if parsed.intra_op_threads == 0:
+        parsed.intra_op_threads = max(1, multiprocessing.cpu_count() // parsed.nr_shards)
+
+    # the thread pools of the math libraries are sized from the environment of the worker at start up
+    os.environ["OMP_NUM_THREADS"] = str(parsed.intra_op_threads)
+    os.environ["MKL_NUM_THREADS"] = str(parsed.intra_op_threads)
+    # workers are spawned, tensorflow does not survive a fork
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_shard, args=(shard, parsed, path)) for shard in range(parsed.nr_shards)]
+    print("{} pages in {} shards, {} intra op / {} inter op threads per shard, logs in {}".format(
+        num_images, parsed.nr_shards, parsed.intra_op_threads, parsed.inter_op_threads, parsed.output_dir))
+
+    start_time = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall_time = time.time() - start_time
+    failed = [shard for shard, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError("shards {} failed, run again to resume them".format(failed))
+    print("{:.1f} s, {:.2f} pages/s".format(wall_time, num_images / wall_time))
+
+    logs = [DetectionLog(shard_dir(parsed, shard)) for shard in range(parsed.nr_shards)]
+    all_boxes = merge_all_boxes(logs, imdb.num_classes, num_images)
+    for log in logs:
+        log.close()
+
+    print('Evaluating detections')
+    imdb.evaluate_detections(all_boxes, cfg.OUT_DIR, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nr_shards", type=int, default=4, help="number of worker processes, each runs its own session on a part of the test set")
+    parser.add_argument("--intra_op_threads", type=int, default=0, help="threads per op of every worker, 0 divides the cores evenly among the shards")
+    parser.add_argument("--inter_op_threads", type=int, default=1, help="number of ops every worker runs in parallel")
+    parser.add_argument("--output_dir", type=str, default=None, help="directory of the detection logs of the shards, if not set a directory in OUT_DIR/shards derived from the net and the detection settings")
+    parser.add_argument("--dataset", type=str, default='DeepScores', help="name of the dataset: DeepScores, DeepScores_300dpi, MUSCIMA, Dota, VOC")
+    parser.add_argument("--test_set", type=str, default="DeepScores_2017_test", help="dataset to perform inference on")
+    parser.add_argument("--net_type", type=str, default="RefineNet-Res152", help="type of resnet used (RefineNet-Res152/101)")
+    parser.add_argument("--net_id", type=str, default="run_0", help="the id of the net you want to perform inference on")
+    parser.add_argument("--saved_net", type=str, default="backbone", help="name (not type) of the net, typically set to backbone")
+    parser.add_argument("--energy_loss", type=str, default="softmax", help="type of the energy loss")
+    parser.add_argument("--class_loss", type=str, default="softmax", help="type of the class loss")
+    parser.add_argument("--bbox_loss", type=str, default="reg", help="type of the bounding boxes loss, must be reg aka regression")
+    parser.add_argument("--individual_upsamp", type=str, default="False", help="upsampling scheme the net was trained with: False, task or sub_task")
+    parser.add_argument("--frozen_graph", type=str, default=None, help="if set, the net is loaded from this frozen GraphDef (see export_graph.py) instead of the checkpoint")
+    parser.add_argument("--uint8_input", type=str, default="False", help="if set to True, images are fed as uint8 and cast and padded in the graph")
+    parser.add_argument("--scaling", type=float, default=.5, help="scale factor applied to images after loading")
+    parser.add_argument("--max_detections", type=int, default=800, help="maximum number of detections kept per image, the ones with the highest score are kept")
+    parser.add_argument("--max_untiled_pixels", type=int, default=3837*2713, help="images with more pixels (after scaling) are run through the net in tiles, tiled outputs differ from whole page ones, see benchmark_tiling.py")
+    parser.add_argument("--tile_size", type=int, default=1280, help="side length of the tiles used for oversized images, multiple of 160")
+    parser.add_argument("--tile_overlap", type=int, default=320, help="overlap of neighbouring tiles, multiple of 160")
+    parser.add_argument("--coarse_to_fine", type=str, default="False", help="if set to True, a low resolution pass of the energy head finds the regions with objects and only these are run at full resolution. Lossy, the maps differ from a single pass, see benchmark_coarse_to_fine.py")
+    parser.add_argument("--coarse_scale", type=float, default=.25, help="scale of the low resolution pass relative to the scaled image")
+    parser.add_argument("--coarse_cutoff", type=int, default=0, help="energy cutoff of the low resolution pass, cells with higher energy are run at full resolution")
+    parser.add_argument("--coarse_context", type=int, default=160, help="context in pixels run around the regions found, rounded up to multiples of 160")
+    parser.add_argument("--coarse_max_fraction", type=float, default=.6, help="if the regions found (by coarse_to_fine or skip_blank) cover more of the page, the whole page is run")
+    parser.add_argument("--skip_blank", type=str, default="False", help="if set to True, the net only runs around the 160 x 160 cells of the page that contain ink, blank cells get no detections. The cells that are run can differ from a single pass, see benchmark_coarse_to_fine.py")
+    parser.add_argument("--blank_tolerance", type=int, default=0, help="pixels that differ by at most this from white count as blank, values above 0 trade accuracy (faint strokes are skipped) for speed")
+    parser.add_argument("--blank_max_ink", type=int, default=0, help="cells with at most this many non blank pixels are skipped, values above 0 trade accuracy for speed")
+    parser.add_argument("--blank_context", type=int, default=160, help="context in pixels run around the cells with ink, rounded up to multiples of 160")
+    parser.add_argument("--pipeline", type=str, default="False", help="if set to True, every worker runs image loading, the net and post-processing as overlapping pipeline stages")
+    parser.add_argument("--queue_size", type=int, default=4, help="size of the queues between the pipeline stages")
+    parser.add_argument("--post_workers", type=int, default=1, help="number of post-processing threads of the pipeline of every worker")
+    parser.add_argument("--cache_dir", type=str, default=None, help="if set, the detections of every page are cached in this directory, shared by the workers")
+    parser.add_argument("--cache_size", type=int, default=2048, help="maximum size of the detection cache in MB, least recently used pages are evicted")
+
+    parsed = parser.parse_known_args()
+    main(parsed)
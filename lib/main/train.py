@@ -41,6 +41,8 @@ def main():
     parser.add_argument("--pad_to", type=int, default=0,
                         help="pad the final image to have edge lengths that are a multiple of this - use 0 to do nothing")
     parser.add_argument("--pad_with", type=int, default=0, help="use this number to pad images")
+    parser.add_argument("--uint8_input", type=str, default="False",
+                        help="feed uint8 images, mean subtraction and padding to pad_to happen in the graph")
 
     parser.add_argument("--prefetch", type=str, default="False", help="use additional process to fetch batches")
     parser.add_argument("--prefetch_len", type=int, default=1, help="prefetch queue len")
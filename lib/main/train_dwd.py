@@ -6,7 +6,7 @@ import sys
 sys.path.insert(0, os.path.dirname(__file__)[:-4])
 from main.config import cfg
 
-from models.dwd_net import build_dwd_net
+from models.dwd_net import build_dwd_net, build_input
 
 from datasets.factory import get_imdb
 from tensorflow.contrib import slim
@@ -82,11 +82,21 @@ def main(parsed):
         resnet_dir = cfg.PRETRAINED_DIR + "/ImageNet/"
         refinenet_dir = cfg.PRETRAINED_DIR + "/VOC2012/"
 
+    net_input = input
+    if args.uint8_input == "True":
+        # feed uint8 blobs, the cast, mean subtraction and padding happen in the graph
+        means = None
+        if args.substract_mean == "True":
+            means = (122.67891434, 116.66876762, 104.00698793)
+        input = tf.placeholder(tf.uint8, shape=[None, None, None, input.shape[-1]])
+        net_input = build_input(input, pad_to=args.pad_to, means=means)
+
     if not (len(args.training_help) == 1 and args.training_help[0] is None):
         # initialize helper_input
         helper_input = tf.placeholder(tf.float32, shape=[None, None, None, input.shape[-1] + 1])
         feed_head = slim.conv2d(helper_input, input.shape[-1], [3, 3], scope='gt_feed_head')
         input = feed_head
+        net_input = feed_head
 
     print("Initializing Model:" + args.model)
     used_heads = set()
@@ -95,7 +105,7 @@ def main(parsed):
     used_heads = list(used_heads)
     # model has all possible output heads (even if unused) to ensure saving and loading goes smoothly
     network_heads, init_fn = build_dwd_net(
-        input, model=args.model, num_classes=nr_classes, pretrained_dir=resnet_dir, substract_mean=False, individual_upsamp = args.individual_upsamp, paired_mode=args.paired_data, used_heads=used_heads, sparse_heads="True")
+        net_input, model=args.model, num_classes=nr_classes, pretrained_dir=resnet_dir, substract_mean=False, individual_upsamp = args.individual_upsamp, paired_mode=args.paired_data, used_heads=used_heads, sparse_heads="True")
 
     # use just one image summary OP for all tasks
     # train
@@ -1,11 +1,42 @@
 from models.RefineNet import build_refinenet
+import numpy as np
 import tensorflow as tf
 from tensorflow.contrib import slim
 from main.config import cfg
 
 
-def build_dwd_net(input,model,num_classes,pretrained_dir,substract_mean = False, individual_upsamp = "False", paired_mode=1,  used_heads=None, sparse_heads="False"):
-    g, init_fn = build_refinenet(input, preset_model=model, num_classes=None, pretrained_dir=pretrained_dir,
+def build_input(input, pad_to=0, pad_value=255, means=None):
+    """
+    In-graph input preparation for uint8 feeding: casts to float32, pads the bottom and right border with pad_value to
+    a multiple of pad_to (0 disables padding) and subtracts the per channel means (if given). For a single channel
+    input the average of the means is subtracted, as the host path averages the channels after the mean subtraction.
+    """
+    net_input = tf.cast(input, tf.float32)
+    if pad_to > 0:
+        shape = tf.shape(net_input)
+        pad_y = (pad_to - shape[1] % pad_to) % pad_to
+        pad_x = (pad_to - shape[2] % pad_to) % pad_to
+        # tf.pad pads with zeros
+        net_input = tf.pad(net_input - pad_value, [[0, 0], [0, pad_y], [0, pad_x], [0, 0]]) + pad_value
+        net_input.set_shape([None, None, None, input.shape[-1]])
+    if means is not None:
+        means = np.asarray(means, dtype=np.float32).reshape(-1)
+        if int(input.shape[-1]) == 1:
+            means = np.mean(means, keepdims=True)
+        net_input = net_input - tf.constant(means, dtype=tf.float32)
+    return net_input
+
+
+def build_dwd_net(input,model,num_classes,pretrained_dir,substract_mean = False, individual_upsamp = "False", paired_mode=1,  used_heads=None, sparse_heads="False",
+                  is_training=True, used_losses=None):
+    """
+    used_losses - optional dict mapping a head to the loss type whose output layers are built (e.g. for inference
+                  {"stamp_energy": "softmax", "stamp_class": "softmax", "stamp_bbox": "reg"}), by default all are built
+    """
+    def builds(head, loss):
+        return used_losses is None or used_losses.get(head, loss) == loss
+
+    g, init_fn = build_refinenet(input, preset_model=model, num_classes=None, pretrained_dir=pretrained_dir, is_training=is_training,
                                  substract_mean=substract_mean,individual_upsamp=individual_upsamp, paired_mode=paired_mode, used_heads=used_heads, sparse_heads=sparse_heads)
 
     if individual_upsamp != "task" and individual_upsamp != "sub_task":
@@ -33,11 +64,13 @@ def build_dwd_net(input,model,num_classes,pretrained_dir,substract_mean = False,
                 # classification
                 network_heads["stamp_class"] = dict()
                 # class binary
-                network_heads["stamp_class"]["binary"] = [slim.conv2d(g[pair_nr]["stamp_class"][x], 2, [1, 1], activation_fn=None, scope='class_binary_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in
-                                                          range(0, len(g[pair_nr]["stamp_class"]))]
+                if builds("stamp_class", "binary"):
+                    network_heads["stamp_class"]["binary"] = [slim.conv2d(g[pair_nr]["stamp_class"][x], 2, [1, 1], activation_fn=None, scope='class_binary_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in
+                                                              range(0, len(g[pair_nr]["stamp_class"]))]
                 # class pred
-                network_heads["stamp_class"]["softmax"] = [slim.conv2d(g[pair_nr]["stamp_class"][x], num_classes, [1, 1], activation_fn=None, scope='class_pred_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in
-                                                           range(0, len(g[pair_nr]["stamp_class"]))]
+                if builds("stamp_class", "softmax"):
+                    network_heads["stamp_class"]["softmax"] = [slim.conv2d(g[pair_nr]["stamp_class"][x], num_classes, [1, 1], activation_fn=None, scope='class_pred_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in
+                                                               range(0, len(g[pair_nr]["stamp_class"]))]
             if "stamp_directions" in used_heads:
                 # direction
                 network_heads["stamp_directions"] = dict()
@@ -47,17 +80,21 @@ def build_dwd_net(input,model,num_classes,pretrained_dir,substract_mean = False,
                 # energy
                 network_heads["stamp_energy"] = dict()
                 # energy marker - regression
-                network_heads["stamp_energy"]["reg"] = [slim.conv2d(g[pair_nr]["stamp_energy"][x], 1, [1, 1], activation_fn=None, scope='energy_reg_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in range(0, len(g[pair_nr]["stamp_energy"]))]
+                if builds("stamp_energy", "reg"):
+                    network_heads["stamp_energy"]["reg"] = [slim.conv2d(g[pair_nr]["stamp_energy"][x], 1, [1, 1], activation_fn=None, scope='energy_reg_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in range(0, len(g[pair_nr]["stamp_energy"]))]
                 # energy marker - logits
-                network_heads["stamp_energy"]["softmax"] = [slim.conv2d(g[pair_nr]["stamp_energy"][x], cfg.TRAIN.MAX_ENERGY, [1, 1], activation_fn=None, scope='energy_logits_' + 'pair' + str(pair_nr) + '_' + str(x)) for x
-                                                            in range(0, len(g[pair_nr]["stamp_energy"]))]
+                if builds("stamp_energy", "softmax"):
+                    network_heads["stamp_energy"]["softmax"] = [slim.conv2d(g[pair_nr]["stamp_energy"][x], cfg.TRAIN.MAX_ENERGY, [1, 1], activation_fn=None, scope='energy_logits_' + 'pair' + str(pair_nr) + '_' + str(x)) for x
+                                                                in range(0, len(g[pair_nr]["stamp_energy"]))]
             if "stamp_bbox" in used_heads:
                 # bounding boxes
                 network_heads["stamp_bbox"] = dict()
                 # bbox_size - reg
-                network_heads["stamp_bbox"]["reg"] = [slim.conv2d(g[pair_nr]["stamp_bbox"][x], 2, [1, 1], activation_fn=None, scope='bbox_reg_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in range(0, len(g[pair_nr]["stamp_bbox"]))]
+                if builds("stamp_bbox", "reg"):
+                    network_heads["stamp_bbox"]["reg"] = [slim.conv2d(g[pair_nr]["stamp_bbox"][x], 2, [1, 1], activation_fn=None, scope='bbox_reg_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in range(0, len(g[pair_nr]["stamp_bbox"]))]
                 # bbox_size - logits
-                network_heads["stamp_bbox"]["softmax"] = [slim.conv2d(g[pair_nr]["stamp_bbox"][x], 2, [1, 1], activation_fn=None, scope='bbox_logits_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in range(0, len(g[pair_nr]["stamp_bbox"]))]
+                if builds("stamp_bbox", "softmax"):
+                    network_heads["stamp_bbox"]["softmax"] = [slim.conv2d(g[pair_nr]["stamp_bbox"][x], 2, [1, 1], activation_fn=None, scope='bbox_logits_' + 'pair' + str(pair_nr) + '_' + str(x)) for x in range(0, len(g[pair_nr]["stamp_bbox"]))]
 
             if "stamp_semseg" in used_heads:
                 # semseg
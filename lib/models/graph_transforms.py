@@ -0,0 +1,317 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import node_def_pb2
+from tensorflow.python.framework import tensor_util
+
+# ops evaluated by fold_constants when all their inputs are constant
+CONSTANT_OPS = {
+    "Add": np.add,
+    "AddV2": np.add,
+    "Sub": np.subtract,
+    "Mul": np.multiply,
+    "RealDiv": np.divide,
+    "Sqrt": np.sqrt,
+    "Rsqrt": lambda x: 1 / np.sqrt(x),
+}
+
+
+def optimize_graph_def(graph_def, output_names):
+    """
+    Inference-graph optimization pass over a frozen GraphDef (see DWSDetector.export_frozen_graph). The graph has to
+    be built with is_training=False, batch norms computing batch statistics can not be folded.
+    inputs:
+        graph_def - frozen GraphDef, all weights are Const nodes
+        output_names - names of the nodes that are fetched or fed, they are never removed
+    returns:
+        optimized GraphDef computing the same outputs
+    """
+    graph_def = strip_nodes(graph_def, output_names)
+    graph_def = fold_constants(graph_def)
+    graph_def = fold_batch_norms(graph_def)
+    graph_def = merge_head_convs(graph_def)
+    return tf.graph_util.extract_sub_graph(graph_def, output_names)
+
+
+def strip_nodes(graph_def, output_names, op_types=("Identity", "Print", "CheckNumerics", "StopGradient")):
+    """
+    Removes pass-through nodes (identities, the variable reads left over by freezing and the tf.Print in
+    Upsampling_scale), their consumers are wired to the first input of the removed node.
+    """
+    mapping = dict()
+    for node in graph_def.node:
+        if node.op in op_types and node.name not in output_names and len(node.input) > 0 \
+                and not node.input[0].startswith("^"):
+            mapping[node.name + ":0"] = node.input[0]
+
+    # follow chains of removed nodes
+    for tensor in mapping:
+        target = mapping[tensor]
+        while _tensor_name(target) in mapping:
+            target = mapping[_tensor_name(target)]
+        mapping[tensor] = target
+
+    return _remove_nodes(_rewire(graph_def, mapping), set(node_name(tensor) for tensor in mapping))
+
+
+def fold_constants(graph_def):
+    """
+    Evaluates the elementwise arithmetic on constants that remains after freezing, e.g. the rsqrt(variance + epsilon)
+    * gamma of an unfused slim.batch_norm, and replaces it by Const nodes.
+    """
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    nodes = dict((node.name, node) for node in output.node)
+    changed = True
+    while changed:
+        changed = False
+        for node in output.node:
+            if node.op not in CONSTANT_OPS or any(tensor.startswith("^") for tensor in node.input):
+                continue
+            values = [const_value(nodes, tensor) for tensor in node.input]
+            if any(value is None or ":" in tensor and not tensor.endswith(":0")
+                   for tensor, value in zip(node.input, values)):
+                continue
+            value = np.asarray(CONSTANT_OPS[node.op](*values), dtype=tf.as_dtype(node.attr["T"].type).as_numpy_dtype)
+            node.op = "Const"
+            del node.input[:]
+            node.attr.clear()
+            node.attr["dtype"].type = tf.as_dtype(value.dtype).as_datatype_enum
+            _set_const(node, value)
+            changed = True
+    return output
+
+
+def fold_batch_norms(graph_def):
+    """
+    Folds inference-mode batch norms into the preceding convolution. Handles FusedBatchNorm and the unfused form
+    conv -> Mul(const) that slim.batch_norm emits, optionally with a BiasAdd between the convolution and the norm.
+    """
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    nodes = dict((node.name, node) for node in output.node)
+    consumers = node_consumers(output)
+    mapping = dict()
+    removed = set()
+    new_nodes = []
+
+    for node in list(output.node):
+        if node.op in ("FusedBatchNorm", "FusedBatchNormV2"):
+            if node.attr["is_training"].b or any(_tensor_name(tensor) != node.name + ":0"
+                                                 for _, tensor in consumers[node.name]):
+                continue
+            params = [const_value(nodes, name) for name in node.input[1:5]]
+            if any(p is None for p in params):
+                continue
+            scale, offset, mean, variance = params
+            multiplier = scale / np.sqrt(variance + node.attr["epsilon"].f)
+            shift = offset - mean * multiplier
+        elif node.op == "Mul":
+            multiplier = const_value(nodes, node.input[1])
+            if multiplier is None:
+                continue
+            shift = None
+        else:
+            continue
+
+        conv, bias_add = _conv_input(nodes, consumers, node.input[0])
+        if conv is None or conv.name in removed:
+            continue
+        weights = const_value(nodes, conv.input[1])
+        if multiplier.size == 1:
+            multiplier = np.full(weights.shape[3], multiplier.reshape(-1)[0], dtype=weights.dtype)
+        multiplier = multiplier.reshape(-1)
+        if multiplier.shape[0] != weights.shape[3]:
+            continue
+        _set_const(nodes[node_name(conv.input[1])], weights * multiplier.astype(weights.dtype))
+
+        if node.op == "Mul":
+            # the conv takes the place of the Mul, a BiasAdd in between is scaled as well
+            if bias_add is not None:
+                bias_node = nodes[node_name(bias_add.input[1])]
+                _set_const(bias_node, const_value(nodes, bias_add.input[1]) * multiplier)
+                source = bias_add
+            else:
+                source = conv
+            mapping[node.name + ":0"] = source.name + ":0"
+            removed.add(node.name)
+            continue
+
+        # the FusedBatchNorm becomes a BiasAdd
+        bias = shift
+        if bias_add is not None:
+            bias = bias + const_value(nodes, bias_add.input[1]) * multiplier
+        bias_const = make_const(node.name + "/folded_bias", bias.astype(weights.dtype))
+        new_nodes.append(bias_const)
+        data_format = node.attr["data_format"].s
+        source = bias_add.input[0] if bias_add is not None else node.input[0]
+        node.op = "BiasAdd"
+        del node.input[:]
+        node.input.extend([source, bias_const.name])
+        for key in list(node.attr.keys()):
+            if key not in ("T", "data_format"):
+                del node.attr[key]
+        node.attr["data_format"].s = data_format
+        if bias_add is not None:
+            removed.add(bias_add.name)
+
+    output = _remove_nodes(_rewire(output, mapping), removed)
+    output.node.extend(new_nodes)
+    return output
+
+
+def merge_head_convs(graph_def):
+    """
+    Merges 1x1 convolutions (with BiasAdd) that read the same tensor, e.g. the energy, class and bbox heads on top of
+    the shared upsampled feature map, into one convolution whose output is split along the channels.
+    """
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    nodes = dict((node.name, node) for node in output.node)
+    consumers = node_consumers(output)
+
+    groups = dict()
+    for node in output.node:
+        if node.op != "Conv2D":
+            continue
+        weights = const_value(nodes, node.input[1])
+        if weights is None or weights.shape[:2] != (1, 1) or len(consumers[node.name]) != 1:
+            continue
+        bias_add = nodes[consumers[node.name][0][0]]
+        if bias_add.op != "BiasAdd" or const_value(nodes, bias_add.input[1]) is None:
+            continue
+        key = (_tensor_name(node.input[0]), node.attr["padding"].s, node.attr["data_format"].s,
+               tuple(node.attr["strides"].list.i))
+        groups.setdefault(key, []).append((node, bias_add, weights))
+
+    mapping = dict()
+    new_nodes = []
+    for key, group in groups.items():
+        if len(group) < 2:
+            continue
+        first_conv, first_bias_add = group[0][0], group[0][1]
+        name = first_conv.name + "_merged"
+        channel_axis = 1 if key[2] == b"NCHW" else 3
+
+        merged_weights = np.concatenate([weights for _, _, weights in group], axis=3)
+        bias = np.concatenate([const_value(nodes, bias_add.input[1]) for _, bias_add, _ in group])
+        sizes = np.array([weights.shape[3] for _, _, weights in group], dtype=np.int32)
+
+        new_nodes.append(make_const(name + "/weights", merged_weights))
+        new_nodes.append(make_const(name + "/biases", bias))
+        new_nodes.append(make_const(name + "/sizes", sizes))
+        new_nodes.append(make_const(name + "/axis", np.array(channel_axis, dtype=np.int32)))
+
+        conv = node_def_pb2.NodeDef()
+        conv.CopyFrom(first_conv)
+        conv.name = name + "/Conv2D"
+        del conv.input[:]
+        conv.input.extend([first_conv.input[0], name + "/weights"])
+
+        bias_add = node_def_pb2.NodeDef()
+        bias_add.CopyFrom(first_bias_add)
+        bias_add.name = name + "/BiasAdd"
+        del bias_add.input[:]
+        bias_add.input.extend([conv.name, name + "/biases"])
+
+        split = node_def_pb2.NodeDef()
+        split.op = "SplitV"
+        split.name = name + "/split"
+        split.input.extend([bias_add.name, name + "/sizes", name + "/axis"])
+        split.attr["T"].CopyFrom(first_conv.attr["T"])
+        split.attr["Tlen"].type = tf.int32.as_datatype_enum
+        split.attr["num_split"].i = len(group)
+        new_nodes += [conv, bias_add, split]
+
+        for nr, (_, old_bias_add, _) in enumerate(group):
+            mapping[old_bias_add.name + ":0"] = "{}:{}".format(split.name, nr)
+
+    output = _rewire(output, mapping)
+    output.node.extend(new_nodes)
+    return output
+
+
+def _remove_nodes(graph_def, names):
+    kept = [node for node in graph_def.node if node.name not in names]
+    del graph_def.node[:]
+    graph_def.node.extend(kept)
+    return graph_def
+
+
+def node_name(tensor):
+    return tensor.lstrip("^").split(":")[0]
+
+
+def _tensor_name(tensor):
+    if tensor.startswith("^"):
+        return tensor
+    return tensor if ":" in tensor else tensor + ":0"
+
+
+def node_consumers(graph_def):
+    """
+    Maps a node name to the list of (consumer name, input tensor) of its data outputs.
+    """
+    consumers = dict((node.name, []) for node in graph_def.node)
+    for node in graph_def.node:
+        for tensor in node.input:
+            if not tensor.startswith("^"):
+                consumers.setdefault(node_name(tensor), []).append((node.name, tensor))
+    return consumers
+
+
+def _rewire(graph_def, mapping):
+    """
+    Copies the graph with every input tensor in mapping replaced by its target, control inputs follow the node.
+    """
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    for node in output.node:
+        inputs = []
+        for tensor in node.input:
+            if tensor.startswith("^"):
+                target = mapping.get(tensor[1:] + ":0")
+                inputs.append("^" + node_name(target) if target is not None else tensor)
+            else:
+                inputs.append(mapping.get(_tensor_name(tensor), tensor))
+        del node.input[:]
+        node.input.extend(inputs)
+    return output
+
+
+def const_value(nodes, tensor):
+    node = nodes.get(node_name(tensor))
+    if node is None or node.op != "Const":
+        return None
+    return tensor_util.MakeNdarray(node.attr["value"].tensor)
+
+
+def _set_const(node, value):
+    node.attr["value"].tensor.CopyFrom(tensor_util.make_tensor_proto(value, dtype=value.dtype, shape=value.shape))
+
+
+def make_const(name, value):
+    node = node_def_pb2.NodeDef()
+    node.op = "Const"
+    node.name = name
+    node.attr["dtype"].type = tf.as_dtype(value.dtype).as_datatype_enum
+    _set_const(node, value)
+    return node
+
+
+def _conv_input(nodes, consumers, tensor):
+    """
+    Returns (conv, bias_add) if tensor is the output of a Conv2D with const weights, possibly followed by a BiasAdd
+    with const bias, where every intermediate output has no other consumer, else (None, None).
+    """
+    node = nodes.get(node_name(tensor))
+    bias_add = None
+    if node is not None and node.op == "BiasAdd" and const_value(nodes, node.input[1]) is not None:
+        if len(consumers[node.name]) != 1:
+            return None, None
+        bias_add = node
+        node = nodes.get(node_name(node.input[0]))
+    if node is None or node.op != "Conv2D" or len(consumers[node.name]) != 1:
+        return None, None
+    if const_value(nodes, node.input[1]) is None or len(consumers[node_name(node.input[1])]) != 1:
+        return None, None
+    return node, bias_add
@@ -0,0 +1,120 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.core.framework import node_def_pb2
+from models.graph_transforms import node_consumers, const_value, make_const, node_name
+
+# position of the output channel axis in the kernel of the ops whose weights are quantized
+OUTPUT_CHANNEL_AXIS = {"Conv2D": 3, "DepthwiseConv2dNative": 2, "Conv2DBackpropInput": 2}
+
+
+def quantize_weights(weights, axis=-1):
+    """
+    Symmetric int8 quantization with one scale per output channel.
+    inputs:
+        weights - float ndarray
+        axis - output channel axis
+    returns:
+        quantized - int8 ndarray of the shape of weights
+        scales - float32 ndarray, broadcastable against weights, weights ~ quantized * scales
+    """
+    axis = axis % weights.ndim
+    reduce_axes = tuple(a for a in range(weights.ndim) if a != axis)
+    scales = np.max(np.abs(weights), axis=reduce_axes, keepdims=True) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.round(weights / scales), -127, 127).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def dequantize_weights(quantized, scales):
+    return quantized.astype(np.float32) * scales
+
+
+def quantize_graph_def(graph_def, min_elements=1024):
+    """
+    Stores the convolution kernels of a frozen GraphDef as int8 with per-channel scales, kernels read through Identity
+    nodes (as left by convert_variables_to_constants) are found as well. Every kernel Const is
+    replaced by an int8 Const, a Cast and a Mul with the scales that keeps the name of the kernel, so the graph is
+    loaded and fed exactly like the float graph (DWSDetector.load_frozen_graph).
+    inputs:
+        graph_def - frozen (and preferably batch norm folded) GraphDef
+        min_elements - smaller kernels, e.g. of the heads, stay float
+    returns:
+        quantized GraphDef, dict with the number of quantized kernels and the bytes of the Consts of the GraphDef
+        before and after. This is the size on disk only, when the session starts the constant folding of
+        TensorFlow's graph optimizer turns the int8 -> Cast -> Mul chains back into float32 constants.
+    """
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    nodes = dict((node.name, node) for node in output.node)
+    consumers = node_consumers(output)
+
+    quantize = dict()
+    for node in output.node:
+        if node.op not in OUTPUT_CHANNEL_AXIS:
+            continue
+        # without strip_nodes the kernel is read through the <var>/read identity left over by freezing
+        kernel_tensor = _skip_identities(nodes, node.input[1])
+        kernel = const_value(nodes, kernel_tensor)
+        if kernel is None or kernel.dtype != np.float32 or kernel.size < min_elements:
+            continue
+        kernel_name = node_name(kernel_tensor)
+        # a kernel shared by ops with different layouts stays float
+        if any(op != node.op for op in _consumer_ops(nodes, consumers, kernel_name)):
+            continue
+        quantize[kernel_name] = (kernel, OUTPUT_CHANNEL_AXIS[node.op])
+
+    stats = dict(kernels=len(quantize), bytes_before=const_bytes(output))
+
+    new_nodes = []
+    for kernel_name, (kernel, axis) in quantize.items():
+        quantized, scales = quantize_weights(kernel, axis)
+        node = nodes[kernel_name]
+        new_nodes.append(make_const(kernel_name + "/quantized", quantized))
+        new_nodes.append(make_const(kernel_name + "/scales", scales))
+
+        cast = node_def_pb2.NodeDef()
+        cast.op = "Cast"
+        cast.name = kernel_name + "/dequantize"
+        cast.input.append(kernel_name + "/quantized")
+        cast.attr["SrcT"].type = tf.int8.as_datatype_enum
+        cast.attr["DstT"].type = tf.float32.as_datatype_enum
+        new_nodes.append(cast)
+
+        # the Const becomes the Mul with the scales, its consumers stay untouched
+        node.op = "Mul"
+        node.attr.clear()
+        node.attr["T"].type = tf.float32.as_datatype_enum
+        node.input.extend([cast.name, kernel_name + "/scales"])
+
+    output.node.extend(new_nodes)
+    stats["bytes_after"] = const_bytes(output)
+    return output, stats
+
+
+def _skip_identities(nodes, tensor):
+    node = nodes.get(node_name(tensor))
+    while node is not None and node.op == "Identity" and len(node.input) > 0 and not node.input[0].startswith("^"):
+        tensor = node.input[0]
+        node = nodes.get(node_name(tensor))
+    return tensor
+
+
+def _consumer_ops(nodes, consumers, name):
+    """
+    Ops of the data consumers of a node, looking through Identity nodes.
+    """
+    ops = []
+    for consumer, _ in consumers[name]:
+        if nodes[consumer].op == "Identity":
+            ops.extend(_consumer_ops(nodes, consumers, consumer))
+        else:
+            ops.append(nodes[consumer].op)
+    return ops
+
+
+def const_bytes(graph_def):
+    """
+    Total size of the values of the Const nodes of a GraphDef.
+    """
+    nodes = dict((node.name, node) for node in graph_def.node)
+    return sum(const_value(nodes, node.name).nbytes for node in graph_def.node if node.op == "Const")
@@ -164,7 +164,7 @@ def get_minibatch(roidb, args, assign, helper, ignore_symbols=0, visualize=0, au
             else:
                 new_blob = im_blob
 
-            if not args.pad_to == 0:
+            if not args.pad_to == 0 and not getattr(args, "uint8_input", "False") == "True":
                 # pad to fit RefineNet #TODO fix refinenet padding problem
                 y_mulity = int(np.ceil(new_blob.shape[1] / float(args.pad_to)))
                 x_mulity = int(np.ceil(new_blob.shape[2] / float(args.pad_to)))
@@ -173,6 +173,12 @@ def get_minibatch(roidb, args, assign, helper, ignore_symbols=0, visualize=0, au
                 new_blob = canv
 
             blob['data'] = new_blob
+            # shape of the ground truth maps: with uint8_input the graph pads the input, so the head outputs and the
+            # maps have the padded shape
+            label_shape = new_blob.shape
+            if not args.pad_to == 0 and getattr(args, "uint8_input", "False") == "True":
+                label_shape = (new_blob.shape[0], int(np.ceil(new_blob.shape[1] / float(args.pad_to))) * args.pad_to,
+                               int(np.ceil(new_blob.shape[2] / float(args.pad_to))) * args.pad_to, new_blob.shape[3])
 
             for i1 in range(len(assign)):
                 if assign[i1]["stamp_func"][0] == "stamp_energy" and assign[i1]["use_obj_seg"] and roidb_subele["objseg_path"] is not None:
@@ -292,7 +298,7 @@ def get_minibatch(roidb, args, assign, helper, ignore_symbols=0, visualize=0, au
 
                 else:
                     # bbox based assign
-                    markers_list = get_markers(blob['data'].shape, gt_boxes, args.nr_classes[0], assign[i1], 0, [])
+                    markers_list = get_markers(label_shape, gt_boxes, args.nr_classes[0], assign[i1], 0, [])
                     blob["assign" + str(i1)] = dict()
                     for i2 in range(len(assign[i1]["ds_factors"])):
                         blob["assign" + str(i1)]["gt_map" + str(i2)] = markers_list[i2]
@@ -479,7 +485,7 @@ def _get_image_blob(roidb, scalings, args):
         # 1 2 0
         im = im[:, :, (0,1,2)]
         # substract mean
-        if args.substract_mean == "True":
+        if args.substract_mean == "True" and not getattr(args, "uint8_input", "False") == "True":
             mean = (122.67891434, 116.66876762, 104.00698793)
             im -= mean
         #im = im.transpose((2, 0, 1))
@@ -504,6 +510,10 @@ def _get_image_blob(roidb, scalings, args):
     if len(im.shape) == 2:
         im = np.expand_dims(im, -1)
     # Create a blob to hold the input images
-    blob = im_list_to_blob([im])
+    if getattr(args, "uint8_input", "False") == "True":
+        # mean subtraction and padding happen in the graph
+        blob = im_list_to_blob([im], dtype=np.uint8)
+    else:
+        blob = im_list_to_blob([im])
 
     return blob
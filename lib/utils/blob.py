@@ -16,21 +16,26 @@ import random
 from PIL import Image
 
 
-def im_list_to_blob(ims):
+def im_list_to_blob(ims, dtype=np.float32):
   """Convert a list of images into a network input.
 
   Assumes images are already prepared (means subtracted, BGR order, ...).
+  With dtype=np.uint8 the images are rounded and clipped, for nets that
+  cast the input in the graph (see models.dwd_net.build_input).
   """
   max_shape = np.array([im.shape for im in ims]).max(axis=0)
   num_images = len(ims)
   if len(ims[0].shape) == 2 :
     blob = np.zeros((num_images, max_shape[0], max_shape[1], 1),
-                    dtype=np.float32)
+                    dtype=dtype)
   else:
     blob = np.zeros((num_images, max_shape[0], max_shape[1], ims[0].shape[2]),
-                    dtype=np.float32)
+                    dtype=dtype)
   for i in range(num_images):
     im = ims[i]
+    if np.issubdtype(dtype, np.integer):
+      info = np.iinfo(dtype)
+      im = np.clip(np.round(im), info.min, info.max)
     blob[i, 0:im.shape[0], 0:im.shape[1], :] = im
 
   return blob
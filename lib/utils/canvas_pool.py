@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class CanvasPool(object):
+    """
+    Shape keyed pool of preallocated input canvases. A canvas returned by get is reset in place the next time its shape
+    is requested, so it is only valid until then (the pool is not thread safe). The least recently used canvases are
+    dropped once more than max_canvases are held or the canvases take more than max_bytes.
+    """
+    def __init__(self, max_canvases=4, max_bytes=None, fill_value=255, dtype=np.uint8):
+        self.max_canvases = max_canvases
+        self.max_bytes = max_bytes
+        self.fill_value = fill_value
+        self.dtype = dtype
+        self.canvases = OrderedDict()
+        # previously overwritten region of every canvas, only that part has to be reset
+        self.dirty = dict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.alloc_time = 0.
+        self.reset_time = 0.
+        self.bytes = 0
+        self.peak_bytes = 0
+
+    def get(self, shape, region=None):
+        """
+        Returns a canvas of the given shape filled with fill_value.
+        inputs:
+            shape - shape of the canvas, [N, H, W, C]
+            region - (h, w) if the caller overwrites canvas[:, :h, :w] anyway, then that part is not reset
+        """
+        shape = tuple(shape)
+        start_time = time.time()
+        canvas = self.canvases.pop(shape, None)
+        if canvas is None:
+            canvas = np.full(shape, self.fill_value, dtype=self.dtype)
+            self.alloc_time += time.time() - start_time
+            self.misses += 1
+            self.bytes += canvas.nbytes
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+        else:
+            dirty_h, dirty_w = self.dirty[shape]
+            h, w = region if region is not None else (0, 0)
+            # reset what was written before and is not covered by the new region
+            canvas[:, h:dirty_h, :dirty_w] = self.fill_value
+            canvas[:, :min(h, dirty_h), w:dirty_w] = self.fill_value
+            self.reset_time += time.time() - start_time
+            self.hits += 1
+
+        self.canvases[shape] = canvas
+        self.dirty[shape] = region if region is not None else shape[1:3]
+        self._evict()
+        return canvas
+
+    def stats(self):
+        return dict(canvas_hits=self.hits, canvas_misses=self.misses, canvas_evictions=self.evictions,
+                    canvas_alloc_time=self.alloc_time, canvas_reset_time=self.reset_time, canvas_bytes=self.bytes,
+                    canvas_peak_bytes=self.peak_bytes)
+
+    def _evict(self):
+        while len(self.canvases) > 1 and (len(self.canvases) > self.max_canvases or
+                                          self.max_bytes is not None and self.bytes > self.max_bytes):
+            shape, canvas = self.canvases.popitem(last=False)
+            del self.dirty[shape]
+            self.bytes -= canvas.nbytes
+            self.evictions += 1
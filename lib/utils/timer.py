@@ -5,7 +5,13 @@
 # Written by Ross Girshick
 # --------------------------------------------------------
 
+from __future__ import print_function
 import time
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
 
 class Timer(object):
     """A simple timer."""
@@ -30,3 +36,95 @@ class Timer(object):
             return self.average_time
         else:
             return self.diff
+
+
+class StageTimer(Timer):
+    """A timer that keeps every measured time, for percentiles."""
+    def __init__(self):
+        Timer.__init__(self)
+        self.times = []
+
+    def toc(self, average=True):
+        result = Timer.toc(self, average)
+        self.times.append(self.diff)
+        return result
+
+    def add(self, diff):
+        """Records a time measured elsewhere, e.g. in another thread."""
+        self.diff = diff
+        self.total_time += diff
+        self.calls += 1
+        self.average_time = self.total_time / self.calls
+        self.times.append(diff)
+
+    def percentile(self, p):
+        return float(np.percentile(self.times, p)) if self.times else 0.
+
+
+class TimingRegistry(object):
+    """
+    Named StageTimers, in the order the stages were first measured. Safe to use from several threads, every
+    measurement keeps its own start time.
+    """
+    def __init__(self):
+        self.timers = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start_time)
+
+    def add(self, stage, diff):
+        with self._lock:
+            if stage not in self.timers:
+                self.timers[stage] = StageTimer()
+            self.timers[stage].add(diff)
+
+    def report(self, nr_items=None, wall_time=None):
+        """
+        returns:
+            dict with calls, total time and mean/p50/p90/p99 in ms per stage, and the throughput in items/s if the
+            number of items and the wall time are given
+        """
+        with self._lock:
+            report = OrderedDict()
+            for stage, timer in self.timers.items():
+                report[stage] = OrderedDict([("calls", timer.calls), ("total_s", timer.total_time),
+                                             ("mean_ms", timer.average_time * 1000)] +
+                                            [("p{}_ms".format(p), timer.percentile(p) * 1000) for p in [50, 90, 99]])
+        if nr_items is not None and wall_time:
+            report["throughput"] = OrderedDict([("items", nr_items), ("wall_time_s", wall_time),
+                                                ("items_per_s", nr_items / wall_time)])
+        return report
+
+    def print_report(self, nr_items=None, wall_time=None):
+        report = self.report(nr_items, wall_time)
+        print("{:<12}{:>8}{:>10}{:>10}{:>10}{:>10}".format("stage", "calls", "total s", "p50 ms", "p90 ms", "p99 ms"))
+        for stage, times in report.items():
+            if stage != "throughput":
+                print("{:<12}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+                    stage, times["calls"], times["total_s"], times["p50_ms"], times["p90_ms"], times["p99_ms"]))
+        if "throughput" in report:
+            print("{} items in {:.2f} s, {:.2f} items/s".format(*report["throughput"].values()))
+
+    def dump(self, file_name, nr_items=None, wall_time=None):
+        with open(file_name, "w") as f:
+            json.dump(self.report(nr_items, wall_time), f, indent=2)
+
+
+def timed(timings, stage):
+    """
+    Context manager measuring the stage in the registry timings, does nothing if timings is None.
+    """
+    if timings is None:
+        return _no_timing()
+    return timings.measure(stage)
+
+
+@contextmanager
+def _no_timing():
+    yield
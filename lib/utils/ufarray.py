@@ -2,6 +2,8 @@
 
 # P: The array, which encodes the set membership of all the elements
 
+import numpy as np
+
 class UFarray:
     def __init__(self):
         # Array which holds label -> set equivalences
@@ -60,3 +62,34 @@ class UFarray:
             else:
                 self.P[i] = k
                 k += 1
+
+
+# Vectorized union find over whole index arrays
+#
+# n: number of elements, labelled 0 .. n-1
+# i, j: integer arrays, element i[k] is equivalent to element j[k]
+#
+# Returns an array which maps every element to the smallest element of its set
+def resolve_equivalences(n, i, j):
+    P = np.arange(n, dtype=np.int64)
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+
+    while i.size > 0:
+        ri = P[i]
+        rj = P[j]
+        mask = ri != rj
+        if not mask.any():
+            break
+        i, j, ri, rj = i[mask], j[mask], ri[mask], rj[mask]
+
+        # hook the larger root onto the smaller one
+        np.minimum.at(P, np.maximum(ri, rj), np.minimum(ri, rj))
+
+        # compress until every element points to its root
+        while True:
+            PP = P[P]
+            if np.array_equal(PP, P):
+                break
+            P = PP
+    return P